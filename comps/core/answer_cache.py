@@ -0,0 +1,148 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from prometheus_client import Counter
+
+from .logger import CustomLogger
+from .query_cache import normalize_query
+
+logger = CustomLogger("answer_cache")
+logflag = os.getenv("LOGFLAG", False)
+
+answer_cache_hits = Counter("megaservice_answer_cache_hits", "Answers served from the semantic answer cache")
+answer_cache_misses = Counter("megaservice_answer_cache_misses", "Questions answered by the full RAG pipeline")
+answer_cache_invalidations = Counter(
+    "megaservice_answer_cache_invalidations", "Cached answers dropped because the corpus changed since caching"
+)
+
+
+def normalize_question(text: str) -> str:
+    """`normalize_query` of `text`, case folded and without trailing punctuation."""
+    return normalize_query(text).casefold().rstrip(" ?!.")
+
+
+class SemanticAnswerCache:
+    """In-memory cache of RAG answers, looked up by question text and query embedding similarity.
+
+    An answer is served for a new question asked with the same `settings`
+    (retrieval parameters, template...) as a cached one, when both questions
+    are equal once normalized or their embeddings are within `threshold`
+    cosine similarity. A threshold of 1 or more only serves equal questions:
+    models such as BGE score questions differing in a single name or number
+    above 0.95. Every entry records the corpus version read from `version_key`
+    before it was computed and the chunks it was answered from: it is dropped
+    instead of served once dataprep has bumped the version, or when one of its
+    chunks no longer exists. At most `max_entries` answers are kept for `ttl`
+    seconds, least recently used first out.
+    """
+
+    def __init__(
+        self,
+        client,
+        threshold: float = 1.0,
+        max_entries: int = 1000,
+        ttl: float = 3600,
+        version_key: str = "corpus:version",
+    ):
+        self.client = client
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version_key = version_key
+        self._entries: List[Dict[str, Any]] = []
+        self._matrix = None
+        self._lock = threading.Lock()
+
+    async def corpus_version(self) -> int:
+        return int(await self.client.get(self.version_key) or 0)
+
+    def _match(self, query, settings: str, question: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            now = time.monotonic()
+            expired = [entry for entry in self._entries if entry["expires"] < now]
+            for entry in expired:
+                self._remove(entry)
+            for entry in self._entries:
+                if entry["question"] == question and entry["settings"] == settings:
+                    return entry
+            if not self._entries or self.threshold >= 1:
+                return None
+            if self._matrix is None:
+                self._matrix = np.stack([entry["embedding"] for entry in self._entries])
+            scores = self._matrix @ query
+            for i in np.argsort(-scores):
+                if scores[i] < self.threshold:
+                    return None
+                if self._entries[i]["settings"] == settings:
+                    return self._entries[i]
+        return None
+
+    def _remove(self, entry: Dict[str, Any]):
+        if entry in self._entries:
+            self._entries.remove(entry)
+            self._matrix = None
+
+    async def lookup(self, embedding: List[float], settings: str, question: str) -> Optional[Dict[str, Any]]:
+        """The cached answer of the same or a similar question, still valid for the current corpus, or None."""
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1)
+        entry = self._match(query, settings, normalize_question(question))
+        if entry is None:
+            answer_cache_misses.inc()
+            return None
+
+        # one round trip checks the corpus version and that every source chunk still exists
+        chunk_ids = list(set(entry["chunk_ids"]))
+        pipe = self.client.pipeline(transaction=False)
+        pipe.get(self.version_key)
+        if chunk_ids:
+            pipe.exists(*chunk_ids)
+        results = await pipe.execute()
+        if int(results[0] or 0) != entry["version"] or (chunk_ids and results[1] != len(chunk_ids)):
+            with self._lock:
+                self._remove(entry)
+            answer_cache_invalidations.inc()
+            answer_cache_misses.inc()
+            if logflag:
+                logger.info("[ answer cache ] dropped an answer computed on a previous version of the corpus")
+            return None
+
+        entry["last_used"] = time.monotonic()
+        answer_cache_hits.inc()
+        return entry
+
+    def store(
+        self,
+        embedding: List[float],
+        settings: str,
+        question: str,
+        version: int,
+        chunk_ids: List[str],
+        answer: str,
+        sources: List[Dict],
+    ):
+        """Cache `answer`, `version` is the corpus version read before retrieving its chunks."""
+        vector = np.asarray(embedding, dtype=np.float32)
+        now = time.monotonic()
+        entry = {
+            "embedding": vector / (np.linalg.norm(vector) or 1),
+            "settings": settings,
+            "question": normalize_question(question),
+            "version": version,
+            "chunk_ids": chunk_ids,
+            "answer": answer,
+            "sources": sources,
+            "expires": now + self.ttl,
+            "last_used": now,
+        }
+        with self._lock:
+            self._entries.append(entry)
+            if len(self._entries) > self.max_entries:
+                self._entries.remove(min(self._entries, key=lambda e: e["last_used"]))
+            self._matrix = None
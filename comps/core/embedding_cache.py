@@ -0,0 +1,197 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import List, Optional
+
+import numpy as np
+import requests
+from langchain_core.embeddings import Embeddings
+from prometheus_client import Counter
+
+from .logger import CustomLogger
+
+logger = CustomLogger("embedding_cache")
+logflag = os.getenv("LOGFLAG", False)
+
+cache_hits = Counter("embedding_cache_hits", "Embeddings served from the embedding cache", ["model"])
+cache_misses = Counter("embedding_cache_misses", "Embeddings computed on an embedding cache miss", ["model"])
+
+# SQLite caps the number of parameters of one statement
+_MAX_PARAMS = 900
+
+
+def text_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Size-bounded on-disk cache of embeddings keyed by model name and text hash.
+
+    Entries live in a SQLite file and survive restarts, index drops and schema
+    changes, so re-embedding a corpus already seen costs a local read. Once the
+    cache holds more than `max_entries` embeddings the least recently used ones
+    are evicted.
+    """
+
+    def __init__(self, path: str, model: str, max_entries: int = 1_000_000):
+        self.path = path
+        self.model = model
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._clock = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL, last_used INTEGER NOT NULL, "
+            "PRIMARY KEY (model, hash))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._clock = self._conn.execute("SELECT COALESCE(MAX(last_used), 0) FROM embeddings").fetchone()[0]
+        self._conn.commit()
+
+    def _tick(self) -> int:
+        self._clock += 1
+        return self._clock
+
+    def _model_key(self, namespace: Optional[str]) -> str:
+        return f"{self.model}:{namespace}" if namespace else self.model
+
+    def get_many(self, texts: List[str], namespace: Optional[str] = None) -> List[Optional[List[float]]]:
+        """Return the cached embedding of every text, None where it is not cached.
+
+        `namespace` separates embeddings of the same model computed differently,
+        e.g. queries embedded with an instruction prefix.
+        """
+        model = self._model_key(namespace)
+        hashes = [text_sha256(text) for text in texts]
+        found = {}
+        with self._lock:
+            for i in range(0, len(hashes), _MAX_PARAMS):
+                batch = list(set(hashes[i : i + _MAX_PARAMS]))
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(batch))})",
+                    [model, *batch],
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = self._tick()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND hash = ?",
+                    [(now, model, h) for h in found],
+                )
+                self._conn.commit()
+
+            vectors = [np.frombuffer(found[h], dtype=np.float32).tolist() if h in found else None for h in hashes]
+            hits = sum(vector is not None for vector in vectors)
+            self.hits += hits
+            self.misses += len(vectors) - hits
+        cache_hits.labels(model=self.model).inc(hits)
+        cache_misses.labels(model=self.model).inc(len(vectors) - hits)
+        return vectors
+
+    def put_many(self, texts: List[str], vectors: List[List[float]], namespace: Optional[str] = None):
+        model = self._model_key(namespace)
+        rows = [
+            (model, text_sha256(text), np.asarray(vector, dtype=np.float32).tobytes())
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            now = self._tick()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(*row, now) for row in rows],
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        excess = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+            if logflag:
+                logger.info(f"[ embedding cache ] evicted {excess} embeddings")
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "model": self.model,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings computing only the texts missing from `cache`."""
+
+    def __init__(self, embedder: Embeddings, cache: EmbeddingCache):
+        self.embedder = embedder
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.cache.get_many(texts)
+        missing = {}
+        for i, (text, vector) in enumerate(zip(texts, vectors)):
+            if vector is None:
+                missing.setdefault(text, []).append(i)
+        if missing:
+            computed = self.embedder.embed_documents(list(missing))
+            self.cache.put_many(list(missing), computed)
+            for indices, vector in zip(missing.values(), computed):
+                for i in indices:
+                    vectors[i] = vector
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self.cache.get_many([text], namespace="query")[0]
+        if vector is None:
+            vector = self.embedder.embed_query(text)
+            self.cache.put_many([text], [vector], namespace="query")
+        return vector
+
+
+def tei_model_key(endpoint: str) -> str:
+    """Cache key of the model served at the TEI `endpoint`: its model id and revision from the /info route.
+
+    Every service reaching the same deployment shares entries whatever the
+    hostname it uses. Falls back to the endpoint URL when /info cannot be read,
+    so the embeddings of an unknown model are never mixed with another's.
+    """
+    try:
+        response = requests.get(endpoint.rstrip("/") + "/info", timeout=10)
+        response.raise_for_status()
+        info = response.json()
+        return f"{info['model_id']}@{info.get('model_sha') or 'main'}"
+    except (requests.RequestException, ValueError, KeyError) as e:
+        logger.warning(f"[ embedding cache ] fail to read the model served at {endpoint}, keying by endpoint: {e}")
+        return endpoint
+
+
+def cached_embeddings(embedder: Embeddings, model: str, path: Optional[str], max_entries: int) -> Embeddings:
+    """Wrap `embedder` with the on-disk cache at `path`, or return it as is when no path is set."""
+    if not path:
+        return embedder
+    try:
+        cache = EmbeddingCache(path, model, max_entries)
+    except (OSError, sqlite3.Error) as e:
+        logger.error(f"[ embedding cache ] fail to open {path}, embeddings are not cached: {e}")
+        return embedder
+    logger.info(f"[ embedding cache ] caching {model} embeddings in {path}")
+    return CachedEmbeddings(embedder, cache)
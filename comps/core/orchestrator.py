@@ -3,26 +3,40 @@
 
 import asyncio
 import copy
-import json
 import os
 import re
 import time
 from typing import Dict, List
 
 import aiohttp
-import requests
 from fastapi.responses import StreamingResponse
-from prometheus_client import Gauge, Histogram
+from prometheus_client import Counter, Gauge, Histogram
 from pydantic import BaseModel
 
 from ..proto.docarray import LLMParams
 from .constants import ServiceType
 from .dag import DAG
 from .logger import CustomLogger
+from .query_cache import QueryEmbeddingCache
 
 logger = CustomLogger("comps-core-orchestrator")
 LOGFLAG = os.getenv("LOGFLAG", False)
 
+# Query embeddings cached by the megaservice, keyed by EMBED_MODEL and the normalized query text.
+# QUERY_EMBED_CACHE_SIZE=0 disables the cache, entries expire after QUERY_EMBED_CACHE_TTL seconds
+EMBED_MODEL = os.getenv("EMBED_MODEL", "BAAI/bge-base-en-v1.5")
+QUERY_EMBED_CACHE_SIZE = int(os.getenv("QUERY_EMBED_CACHE_SIZE", 10000))
+QUERY_EMBED_CACHE_TTL = float(os.getenv("QUERY_EMBED_CACHE_TTL", 3600))
+
+# Connection pool of the HTTP session shared by all requests to the microservices: total and per host
+# connections, seconds an idle connection is kept alive, and seconds resolved host names are cached
+MEGASERVICE_CONN_LIMIT = int(os.getenv("MEGASERVICE_CONN_LIMIT", 512))
+MEGASERVICE_CONN_PER_HOST = int(os.getenv("MEGASERVICE_CONN_PER_HOST", 128))
+MEGASERVICE_KEEPALIVE_TIMEOUT = float(os.getenv("MEGASERVICE_KEEPALIVE_TIMEOUT", 60))
+MEGASERVICE_DNS_CACHE_TTL = int(os.getenv("MEGASERVICE_DNS_CACHE_TTL", 300))
+# streamed generations can take long, only the connection and the wait between two chunks are bounded
+STREAM_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=1000, sock_read=1000)
+
 
 class OrchestratorMetrics:
     # Because:
@@ -34,10 +48,30 @@ class OrchestratorMetrics:
     inter_token_latency = Histogram("megaservice_inter_token_latency", "Inter-token latency (histogram)")
     request_latency = Histogram("megaservice_request_latency", "Whole request/reply latency (histogram)")
     request_pending = Gauge("megaservice_request_pending", "Count of currently pending requests (gauge)")
+    connections_created = Counter(
+        "megaservice_http_connections_created", "Connections opened to the microservices (counter)"
+    )
+    connections_reused = Counter(
+        "megaservice_http_connections_reused", "Requests sent on a kept-alive connection (counter)"
+    )
 
     def __init__(self) -> None:
         pass
 
+    def trace_config(self) -> aiohttp.TraceConfig:
+        """Count the connections opened and reused by a client session."""
+
+        async def on_connection_create_end(session, context, params):
+            self.connections_created.inc()
+
+        async def on_connection_reuseconn(session, context, params):
+            self.connections_reused.inc()
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace_config
+
     def token_update(self, token_start: float, is_first: bool) -> float:
         now = time.time()
         if is_first:
@@ -62,8 +96,36 @@ class ServiceOrchestrator(DAG):
     def __init__(self) -> None:
         self.metrics = OrchestratorMetrics()
         self.services = {}  # all services, id -> service
+        self.query_embeddings = QueryEmbeddingCache(EMBED_MODEL, QUERY_EMBED_CACHE_SIZE, QUERY_EMBED_CACHE_TTL)
+        self._session = None
         super().__init__()
 
+    async def open_session(self) -> aiohttp.ClientSession:
+        """The HTTP session shared by all requests, so calls to the microservices reuse kept-alive connections.
+
+        Created on first use, the session is bound to the event loop running the
+        megaservice. Call `close` when the service stops.
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=MEGASERVICE_CONN_LIMIT,
+                limit_per_host=MEGASERVICE_CONN_PER_HOST,
+                keepalive_timeout=MEGASERVICE_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=MEGASERVICE_DNS_CACHE_TTL,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=1000),
+                trust_env=True,
+                trace_configs=[self.metrics.trace_config()],
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
     def add(self, service):
         if service.name not in self.services:
             self.services[service.name] = service
@@ -90,58 +152,57 @@ class ServiceOrchestrator(DAG):
         if LOGFLAG:
             logger.info(initial_inputs)
 
-        timeout = aiohttp.ClientTimeout(total=1000)
-        async with aiohttp.ClientSession(trust_env=True, timeout=timeout) as session:
-            pending = {
-                asyncio.create_task(
-                    self.execute(session, req_start, node, initial_inputs, runtime_graph, llm_parameters, **kwargs)
-                )
-                for node in self.ind_nodes()
-            }
-            ind_nodes = self.ind_nodes()
-
-            while pending:
-                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
-                for done_task in done:
-                    response, node = await done_task
-                    result_dict[node] = response
-
-                    # traverse the current node's downstream nodes and execute if all one's predecessors are finished
-                    downstreams = runtime_graph.downstream(node)
-
-                    # remove all the black nodes that are skipped to be forwarded to
-                    if not isinstance(response, StreamingResponse) and "downstream_black_list" in response:
-                        for black_node in response["downstream_black_list"]:
-                            for downstream in reversed(downstreams):
-                                try:
-                                    if re.findall(black_node, downstream):
-                                        if LOGFLAG:
-                                            logger.info(f"skip forwardding to {downstream}...")
-                                        runtime_graph.delete_edge(node, downstream)
-                                        downstreams.remove(downstream)
-                                except re.error as e:
-                                    logger.error("Pattern invalid! Operation cancelled.")
-                            if len(downstreams) == 0 and llm_parameters.stream:
-                                # turn the response to a StreamingResponse
-                                # to make the response uniform to UI
-                                def fake_stream(text):
-                                    yield "data: b'" + text + "'\n\n"
-                                    yield "data: [DONE]\n\n"
-
-                                result_dict[node] = StreamingResponse(
-                                    fake_stream(response["text"]), media_type="text/event-stream"
-                                )
+        session = await self.open_session()
+        pending = {
+            asyncio.create_task(
+                self.execute(session, req_start, node, initial_inputs, runtime_graph, llm_parameters, **kwargs)
+            )
+            for node in self.ind_nodes()
+        }
+        ind_nodes = self.ind_nodes()
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for done_task in done:
+                response, node = await done_task
+                result_dict[node] = response
+
+                # traverse the current node's downstream nodes and execute if all one's predecessors are finished
+                downstreams = runtime_graph.downstream(node)
+
+                # remove all the black nodes that are skipped to be forwarded to
+                if not isinstance(response, StreamingResponse) and "downstream_black_list" in response:
+                    for black_node in response["downstream_black_list"]:
+                        for downstream in reversed(downstreams):
+                            try:
+                                if re.findall(black_node, downstream):
+                                    if LOGFLAG:
+                                        logger.info(f"skip forwardding to {downstream}...")
+                                    runtime_graph.delete_edge(node, downstream)
+                                    downstreams.remove(downstream)
+                            except re.error as e:
+                                logger.error("Pattern invalid! Operation cancelled.")
+                        if len(downstreams) == 0 and llm_parameters.stream:
+                            # turn the response to a StreamingResponse
+                            # to make the response uniform to UI
+                            def fake_stream(text):
+                                yield "data: b'" + text + "'\n\n"
+                                yield "data: [DONE]\n\n"
+
+                            result_dict[node] = StreamingResponse(
+                                fake_stream(response["text"]), media_type="text/event-stream"
+                            )
 
-                    for d_node in downstreams:
-                        if all(i in result_dict for i in runtime_graph.predecessors(d_node)):
-                            inputs = self.process_outputs(runtime_graph.predecessors(d_node), result_dict)
-                            pending.add(
-                                asyncio.create_task(
-                                    self.execute(
-                                        session, req_start, d_node, inputs, runtime_graph, llm_parameters, **kwargs
-                                    )
+                for d_node in downstreams:
+                    if all(i in result_dict for i in runtime_graph.predecessors(d_node)):
+                        inputs = self.process_outputs(runtime_graph.predecessors(d_node), result_dict)
+                        pending.add(
+                            asyncio.create_task(
+                                self.execute(
+                                    session, req_start, d_node, inputs, runtime_graph, llm_parameters, **kwargs
                                 )
                             )
+                        )
         nodes_to_keep = []
         for i in ind_nodes:
             nodes_to_keep.append(i)
@@ -158,6 +219,28 @@ class ServiceOrchestrator(DAG):
 
         return result_dict, runtime_graph
 
+    async def embed_query(self, text: str):
+        """Response of the embedding node for `text`, served from the query embedding cache when possible.
+
+        Lets a megaservice embed the question before scheduling the whole graph,
+        the embedding node of the following `schedule` call then hits the cache.
+        """
+        node = next((name for name, s in self.services.items() if s.service_type == ServiceType.EMBEDDING), None)
+        if node is None:
+            return None
+        if self.query_embeddings.enabled:
+            data = self.query_embeddings.get(text)
+            if data is not None:
+                return copy.deepcopy(data)
+        inputs = self.align_inputs({"text": text}, node, self, LLMParams().dict())
+        session = await self.open_session()
+        async with session.post(self.services[node].endpoint_path, json=inputs) as response:
+            response.raise_for_status()
+            data = await response.json()
+        if self.query_embeddings.enabled:
+            self.query_embeddings.put(text, copy.deepcopy(data))
+        return data
+
     def process_outputs(self, prev_nodes: List, result_dict: Dict) -> Dict:
         all_outputs = {}
 
@@ -190,17 +273,10 @@ class ServiceOrchestrator(DAG):
         inputs = self.align_inputs(inputs, cur_node, runtime_graph, llm_parameters_dict, **kwargs)
 
         if is_llm_vlm and llm_parameters.stream:
-            # Still leave to sync requests.post for StreamingResponse
+            # the response is read by the generator below, after execute returns
             if LOGFLAG:
                 logger.info(inputs)
-            response = requests.post(
-                url=endpoint,
-                data=json.dumps(inputs),
-                headers={"Content-type": "application/json"},
-                proxies={"http": None},
-                stream=True,
-                timeout=1000,
-            )
+            response = await session.post(endpoint, json=inputs, timeout=STREAM_TIMEOUT)
             downstream = runtime_graph.downstream(cur_node)
             if downstream:
                 assert len(downstream) == 1, "Not supported multiple stream downstreams yet!"
@@ -208,39 +284,41 @@ class ServiceOrchestrator(DAG):
                 hitted_ends = [".", "?", "!", "。", "，", "！"]
                 downstream_endpoint = self.services[downstream[0]].endpoint_path
 
-            def generate():
+            async def generate():
                 token_start = req_start
-                if response:
-                    # response.elapsed = time until first headers received
-                    buffered_chunk_str = ""
-                    is_first = True
-                    for chunk in response.iter_content(chunk_size=None):
-                        if chunk:
-                            if downstream:
-                                chunk = chunk.decode("utf-8")
-                                buffered_chunk_str += self.extract_chunk_str(chunk)
-                                is_last = chunk.endswith("[DONE]\n\n")
-                                if (buffered_chunk_str and buffered_chunk_str[-1] in hitted_ends) or is_last:
-                                    res = requests.post(
-                                        url=downstream_endpoint,
-                                        data=json.dumps({"text": buffered_chunk_str}),
-                                        proxies={"http": None},
-                                    )
-                                    res_json = res.json()
-                                    if "text" in res_json:
-                                        res_txt = res_json["text"]
-                                    else:
-                                        raise Exception("Other response types not supported yet!")
-                                    buffered_chunk_str = ""  # clear
-                                    yield from self.token_generator(
-                                        res_txt, token_start, is_first=is_first, is_last=is_last
-                                    )
-                                    token_start = time.time()
-                            else:
-                                token_start = self.metrics.token_update(token_start, is_first)
-                                yield chunk
-                            is_first = False
-                    self.metrics.request_update(req_start)
+                try:
+                    if response.status < 400:
+                        buffered_chunk_str = ""
+                        is_first = True
+                        async for chunk in response.content.iter_any():
+                            if chunk:
+                                if downstream:
+                                    chunk = chunk.decode("utf-8")
+                                    buffered_chunk_str += self.extract_chunk_str(chunk)
+                                    is_last = chunk.endswith("[DONE]\n\n")
+                                    if (buffered_chunk_str and buffered_chunk_str[-1] in hitted_ends) or is_last:
+                                        async with session.post(
+                                            downstream_endpoint, json={"text": buffered_chunk_str}
+                                        ) as res:
+                                            res_json = await res.json()
+                                        if "text" in res_json:
+                                            res_txt = res_json["text"]
+                                        else:
+                                            raise Exception("Other response types not supported yet!")
+                                        buffered_chunk_str = ""  # clear
+                                        for token in self.token_generator(
+                                            res_txt, token_start, is_first=is_first, is_last=is_last
+                                        ):
+                                            yield token
+                                        token_start = time.time()
+                                else:
+                                    token_start = self.metrics.token_update(token_start, is_first)
+                                    yield chunk
+                                is_first = False
+                        self.metrics.request_update(req_start)
+                finally:
+                    # also runs when the client disconnects mid-stream
+                    response.release()
                     self.metrics.pending_update(False)
 
             return (
@@ -256,6 +334,24 @@ class ServiceOrchestrator(DAG):
                 input_data = {k: v for k, v in input_data.items() if v is not None}
             else:
                 input_data = inputs
+
+            # repeated questions are answered from the query embedding cache, skipping the embedding hop
+            query = input_data.get("inputs")
+            cache_query = (
+                self.services[cur_node].service_type == ServiceType.EMBEDDING
+                and self.query_embeddings.enabled
+                and isinstance(query, str)
+            )
+            if cache_query:
+                data = self.query_embeddings.get(query)
+                if data is not None:
+                    if LOGFLAG:
+                        logger.info(f"query embedding cache hit on {cur_node}")
+                    data = self.align_outputs(
+                        copy.deepcopy(data), cur_node, inputs, runtime_graph, llm_parameters_dict, **kwargs
+                    )
+                    return data, cur_node
+
             async with session.post(endpoint, json=input_data) as response:
                 if response.content_type == "audio/wav":
                     audio_data = await response.read()
@@ -265,6 +361,8 @@ class ServiceOrchestrator(DAG):
                 else:
                     # Parse as JSON
                     data = await response.json()
+                    if cache_query and response.status == 200:
+                        self.query_embeddings.put(query, copy.deepcopy(data))
                     # post process
                     data = self.align_outputs(data, cur_node, inputs, runtime_graph, llm_parameters_dict, **kwargs)
 
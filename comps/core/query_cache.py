@@ -0,0 +1,79 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Optional
+
+from prometheus_client import Counter
+
+query_cache_hits = Counter(
+    "megaservice_query_embedding_cache_hits", "Query embeddings served from the megaservice cache", ["model"]
+)
+query_cache_misses = Counter(
+    "megaservice_query_embedding_cache_misses", "Query embeddings requested from the embedding service", ["model"]
+)
+
+_SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    """Unicode NFKC form of `text` with runs of whitespace collapsed, case is kept as it can change the embedding."""
+    return _SPACES_RE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+class QueryEmbeddingCache:
+    """In-memory LRU cache of query embeddings with a time to live.
+
+    Keyed by the embedding model and the normalized query text, so retried or
+    repeated questions skip the embedding service. At most `max_entries`
+    embeddings are kept, the least recently used are evicted first, and an
+    entry older than `ttl` seconds is a miss. A cache of size 0 is disabled.
+    """
+
+    def __init__(self, model: str, max_entries: int = 10000, ttl: float = 3600):
+        self.model = model
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, text: str) -> Optional[Any]:
+        key = normalize_query(text)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] < time.monotonic():
+            del self._entries[key]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            query_cache_misses.labels(model=self.model).inc()
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        query_cache_hits.labels(model=self.model).inc()
+        return entry[1]
+
+    def put(self, text: str, embedding: Any):
+        key = normalize_query(text)
+        self._entries[key] = (time.monotonic() + self.ttl, embedding)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "model": self.model,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
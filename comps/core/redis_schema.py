@@ -0,0 +1,165 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import yaml
+from redis.commands.search.field import NumericField, TagField, TextField, VectorField
+from redis.commands.search.indexDefinition import IndexDefinition, IndexType
+from redis.exceptions import ResponseError
+
+# FLOAT16 vectors take half the memory of FLOAT32, they need Redis Stack 7.4 or later
+VECTOR_DTYPES = {
+    "FLOAT16": np.float16,
+    "FLOAT32": np.float32,
+    "FLOAT64": np.float64,
+}
+
+# optional vector attributes of the schema file and their FT.CREATE names, per algorithm
+VECTOR_ATTRIBUTES = {
+    "FLAT": {"initial_cap": "INITIAL_CAP", "block_size": "BLOCK_SIZE"},
+    "HNSW": {
+        "initial_cap": "INITIAL_CAP",
+        "m": "M",
+        "ef_construction": "EF_CONSTRUCTION",
+        "ef_runtime": "EF_RUNTIME",
+        "epsilon": "EPSILON",
+    },
+}
+
+
+class IndexSchema:
+    """Layout of the chunk hashes of a vector index.
+
+    Read from the same langchain-style schema file the retriever hands to
+    langchain (`text`, `tag`, `numeric` and `vector` field lists), so services
+    writing or searching the index directly agree with it on field names and
+    vector encoding.
+    """
+
+    def __init__(
+        self,
+        text: Optional[List[Dict]] = None,
+        tag: Optional[List[Dict]] = None,
+        numeric: Optional[List[Dict]] = None,
+        vector: Optional[List[Dict]] = None,
+        content_key: str = "content",
+    ):
+        self.text = text or []
+        self.tag = tag or []
+        self.numeric = numeric or []
+        self.content_key = content_key
+        if not any(field["name"] == content_key for field in self.text):
+            self.text.insert(0, {"name": content_key})
+        vector = vector or [{"name": "content_vector", "algorithm": "FLAT"}]
+        if len(vector) != 1:
+            raise ValueError("Exactly one vector field is supported")
+        self.vector = {"datatype": "FLOAT32", "distance_metric": "COSINE", **vector[0]}
+        self.vector["algorithm"] = self.vector["algorithm"].upper()
+        self.vector["datatype"] = self.vector["datatype"].upper()
+        self.vector["distance_metric"] = self.vector["distance_metric"].upper()
+        if self.vector["algorithm"] not in VECTOR_ATTRIBUTES:
+            raise ValueError(f"Unsupported vector algorithm {self.vector['algorithm']}")
+        if self.vector["datatype"] not in VECTOR_DTYPES:
+            raise ValueError(f"Unsupported vector datatype {self.vector['datatype']}")
+
+    @classmethod
+    def from_yaml(cls, path: str, vector_overrides: Optional[Dict] = None) -> "IndexSchema":
+        """Read the schema file, `vector_overrides` replaces attributes of its vector field, None values are ignored."""
+        with open(path) as f:
+            schema = yaml.safe_load(f) or {}
+        overrides = {name: value for name, value in (vector_overrides or {}).items() if value is not None}
+        if overrides:
+            vector = schema.get("vector") or [{"name": "content_vector", "algorithm": "FLAT"}]
+            schema["vector"] = [{**vector[0], **overrides}, *vector[1:]]
+        return cls(**schema)
+
+    @property
+    def algorithm(self) -> str:
+        return self.vector["algorithm"]
+
+    @property
+    def vector_key(self) -> str:
+        return self.vector["name"]
+
+    @property
+    def vector_dtype(self):
+        return VECTOR_DTYPES[self.vector["datatype"]]
+
+    @property
+    def tag_keys(self) -> List[str]:
+        return [field["name"] for field in self.tag]
+
+    @property
+    def numeric_keys(self) -> List[str]:
+        return [field["name"] for field in self.numeric]
+
+    @property
+    def metadata_keys(self) -> List[str]:
+        text_keys = [field["name"] for field in self.text if field["name"] != self.content_key]
+        return text_keys + self.tag_keys + self.numeric_keys
+
+    def vector_to_bytes(self, vector) -> bytes:
+        return np.asarray(vector, dtype=self.vector_dtype).tobytes()
+
+    def get_fields(self, dims: Optional[int] = None) -> List:
+        """Redis field definitions, `dims` overrides the dimension of the schema file."""
+        fields = [TextField(field["name"]) for field in self.text]
+        fields += [TagField(field["name"], separator=field.get("separator", ",")) for field in self.tag]
+        fields += [NumericField(field["name"]) for field in self.numeric]
+
+        attributes = {
+            "TYPE": self.vector["datatype"],
+            "DIM": dims or self.vector["dims"],
+            "DISTANCE_METRIC": self.vector["distance_metric"],
+        }
+        # attributes of the other algorithm are ignored, so switching algorithm only takes INDEX_ALGORITHM
+        for name, attribute in VECTOR_ATTRIBUTES[self.algorithm].items():
+            if self.vector.get(name) is not None:
+                attributes[attribute] = self.vector[name]
+        fields.append(VectorField(self.vector_key, self.vector["algorithm"], attributes))
+        return fields
+
+    def create_index(self, client, index_name: str, prefix: str, dims: Optional[int] = None):
+        """Create the index over the hashes under `prefix`."""
+        definition = IndexDefinition(prefix=[prefix], index_type=IndexType.HASH)
+        client.ft(index_name).create_index(fields=self.get_fields(dims), definition=definition)
+
+
+def vector_index_overrides() -> Dict[str, Optional[str]]:
+    """Overrides of the vector field of the schema file, e.g. INDEX_ALGORITHM=HNSW HNSW_M=32 INDEX_DATATYPE=FLOAT16.
+
+    Applied when the index is created, see comps/retriever/rebuild_index.py to
+    change an existing index. Shared by dataprep and the retriever so both
+    describe the same index.
+    """
+    return {
+        "algorithm": os.getenv("INDEX_ALGORITHM"),
+        "m": os.getenv("HNSW_M"),
+        "ef_construction": os.getenv("HNSW_EF_CONSTRUCTION"),
+        "ef_runtime": os.getenv("HNSW_EF_RUNTIME"),
+        "datatype": os.getenv("INDEX_DATATYPE"),
+    }
+
+
+def index_exists(client, index_name: str) -> bool:
+    try:
+        client.ft(index_name).info()
+    except ResponseError:
+        return False
+    return True
+
+
+def index_attributes(client, index_name: str) -> Dict[str, str]:
+    """Type of every field of an existing index by field name, empty when the index does not exist."""
+    try:
+        info = client.ft(index_name).info()
+    except ResponseError:
+        return {}
+    attributes = {}
+    for attribute in info.get("attributes", []):
+        values = [value.decode() if isinstance(value, bytes) else value for value in attribute]
+        attributes[values[values.index("attribute") + 1]] = values[values.index("type") + 1]
+    return attributes
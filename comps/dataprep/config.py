@@ -3,9 +3,18 @@
 
 import os
 
+from comps.core.redis_schema import vector_index_overrides
+
 # Embedding model
 
 EMBED_MODEL = os.getenv("EMBED_MODEL", "BAAI/bge-base-en-v1.5")
+# Use a TEI endpoint service instead of the local embedding model when set
+TEI_ENDPOINT = os.getenv("TEI_ENDPOINT")
+
+# On-disk embedding cache shared by re-ingests, set EMBED_CACHE_PATH to an empty string to disable it
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "./embedding_cache/embeddings.db")
+# Number of embeddings kept in the cache before evicting the least recently used ones
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", 200000))
 
 # Redis Connection Information
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
@@ -61,6 +70,49 @@ REDIS_URL = format_redis_conn_from_env()
 INDEX_NAME = os.getenv("INDEX_NAME", "rag-redis")
 KEY_INDEX_NAME = os.getenv("KEY_INDEX_NAME", "file-keys")
 
+# Chunk hash layout, shared with the retriever so both services agree on the indexed fields
+current_file_path = os.path.abspath(__file__)
+parent_dir = os.path.dirname(current_file_path)
+REDIS_SCHEMA = os.getenv("REDIS_SCHEMA", "redis_schema_multi.yml")
+INDEX_SCHEMA = os.path.join(parent_dir, "..", "retriever", REDIS_SCHEMA)
+
+# INDEX_ALGORITHM, HNSW_* and INDEX_DATATYPE overrides of the vector field of the schema file
+VECTOR_INDEX_OVERRIDES = vector_index_overrides()
+
 TIMEOUT_SECONDS = int(os.getenv("TIMEOUT_SECONDS", 600))
 
 SEARCH_BATCH_SIZE = int(os.getenv("SEARCH_BATCH_SIZE", 10))
+
+# Reverse mapping from chunk id to its source file for chunks ingested before
+# provenance was stored on the chunk hashes
+CHUNK_MAP_PREFIX = os.getenv("CHUNK_MAP_PREFIX", "chunk-file:")
+
+# Content hash of a chunk -> key of a chunk hash holding its embedding
+CHUNK_HASH_PREFIX = os.getenv("CHUNK_HASH_PREFIX", "chunk-hash:")
+
+# Number of chunks embedded per batch at ingest
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 32))
+# Number of chunk writes buffered in the ingest pipeline before sending them to Redis
+INGEST_FLUSH_SIZE = int(os.getenv("INGEST_FLUSH_SIZE", 512))
+# Number of embedded batches allowed to wait for the Redis writer during ingest
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 2))
+# Number of processes parsing and chunking the files of a multi-file upload
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", os.cpu_count() or 1))
+# Number of background ingest jobs processed at the same time
+INGEST_JOB_CONCURRENCY = int(os.getenv("INGEST_JOB_CONCURRENCY", 1))
+# Number of finished ingest jobs kept for progress polling
+INGEST_JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", 1000))
+
+# Number of files kept up to date for the file listing totals
+FILE_COUNT_KEY = os.getenv("FILE_COUNT_KEY", "file-keys:count")
+# Default and maximum page size of /v1/dataprep/list_files
+FILE_LIST_PAGE_SIZE = int(os.getenv("FILE_LIST_PAGE_SIZE", 100))
+FILE_LIST_MAX_PAGE_SIZE = int(os.getenv("FILE_LIST_MAX_PAGE_SIZE", 1000))
+# Idle time after which a listing cursor expires on the Redis side
+FILE_LIST_CURSOR_IDLE_MS = int(os.getenv("FILE_LIST_CURSOR_IDLE_MS", 300000))
+
+# Corpus version incremented on every ingest and delete, read by the megaservice to invalidate cached answers
+CORPUS_VERSION_KEY = os.getenv("CORPUS_VERSION_KEY", "corpus:version")
+
+# Also append ingested chunks to the memory-mapped local store read by the retriever's local engine
+LOCAL_STORE_PATH = os.getenv("LOCAL_STORE_PATH")
@@ -0,0 +1,94 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import threading
+import time
+from typing import Optional
+
+from config import EMBED_CACHE_MAX_ENTRIES, EMBED_CACHE_PATH, EMBED_MODEL, TEI_ENDPOINT
+from langchain_community.embeddings import HuggingFaceBgeEmbeddings
+from langchain_huggingface import HuggingFaceEndpointEmbeddings
+
+from comps import CustomLogger
+from comps.core.embedding_cache import CachedEmbeddings, cached_embeddings, tei_model_key
+
+logger = CustomLogger("embedder")
+logflag = os.getenv("LOGFLAG", False)
+
+
+class EmbedderRegistry:
+    """Process-wide embedder shared by every ingest call.
+
+    The model weights are loaded once and warmed up with a dummy query, so
+    uploads do not pay for reloading the model from disk. Embeddings go through
+    the on-disk embedding cache when `EMBED_CACHE_PATH` is set.
+    """
+
+    def __init__(self, model_name: str = EMBED_MODEL, tei_endpoint: Optional[str] = TEI_ENDPOINT):
+        self.model_name = model_name
+        self.tei_endpoint = tei_endpoint
+        self.load_seconds = None
+        self._embedder = None
+        self._error = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._embedder is not None:
+                return self._embedder
+            start = time.time()
+            try:
+                if self.tei_endpoint:
+                    # create embeddings using TEI endpoint service
+                    embedder = HuggingFaceEndpointEmbeddings(model=self.tei_endpoint)
+                else:
+                    # create embeddings using local embedding model
+                    embedder = HuggingFaceBgeEmbeddings(model_name=self.model_name)
+                # the first forward pass allocates the inference buffers
+                embedder.embed_query("warm up")
+                # EMBED_MODEL does not name the model a TEI endpoint serves
+                model = tei_model_key(self.tei_endpoint) if self.tei_endpoint else self.model_name
+                embedder = cached_embeddings(embedder, model, EMBED_CACHE_PATH, EMBED_CACHE_MAX_ENTRIES)
+            except Exception as e:
+                self._error = e
+                logger.error(f"[ embedder ] fail to load {self.tei_endpoint or self.model_name}: {e}")
+                raise
+            self._embedder = embedder
+            self._error = None
+            self.load_seconds = time.time() - start
+            logger.info(f"[ embedder ] {self.tei_endpoint or self.model_name} ready in {self.load_seconds:.2f}s")
+            return embedder
+
+    def _load_in_background(self):
+        try:
+            self._load()
+        except Exception:
+            # reported through status(), the next get() retries
+            pass
+
+    def start(self):
+        """Load the embedder in a background thread while the service comes up."""
+        threading.Thread(target=self._load_in_background, name="embedder-warmup", daemon=True).start()
+
+    def get(self):
+        """Return the shared embedder, waiting for it to be loaded if needed."""
+        if self._embedder is not None:
+            return self._embedder
+        return self._load()
+
+    @property
+    def ready(self) -> bool:
+        return self._embedder is not None
+
+    def status(self) -> dict:
+        return {
+            "model": self.tei_endpoint or self.model_name,
+            "ready": self.ready,
+            "load_seconds": self.load_seconds,
+            "error": str(self._error) if self._error else None,
+            "cache": self._embedder.cache.stats() if isinstance(self._embedder, CachedEmbeddings) else None,
+        }
+
+
+embedder_registry = EmbedderRegistry()
@@ -0,0 +1,133 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+from config import INGEST_JOB_CONCURRENCY, INGEST_JOB_HISTORY
+
+from comps import CustomLogger, DocPath
+
+logger = CustomLogger("ingest_jobs")
+logflag = os.getenv("LOGFLAG", False)
+
+
+class IngestJob:
+    """Progress of one background ingest of uploaded files."""
+
+    def __init__(self, doc_paths: List[DocPath]):
+        self.job_id = uuid.uuid4().hex
+        self.doc_paths = doc_paths
+        self.stage = "queued"
+        self.files = []
+        self.files_parsed = 0
+        self.chunks_total = 0
+        self.chunks_done = 0
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def file_parsed(self, num_chunks: int):
+        with self._lock:
+            self.files_parsed += 1
+            self.chunks_total += num_chunks
+
+    def advance(self, num_chunks: int):
+        with self._lock:
+            self.chunks_done += num_chunks
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    def to_dict(self) -> dict:
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        throughput = self.chunks_done / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if not self.finished and throughput > 0 and self.files_parsed == len(self.doc_paths):
+            eta = (self.chunks_total - self.chunks_done) / throughput
+        return {
+            "job_id": self.job_id,
+            "stage": self.stage,
+            "files_total": len(self.doc_paths),
+            "files_parsed": self.files_parsed,
+            "chunks_total": self.chunks_total,
+            "chunks_done": self.chunks_done,
+            "elapsed_seconds": elapsed,
+            "chunks_per_second": throughput,
+            "eta_seconds": eta,
+            "files": self.files,
+            "error": self.error,
+        }
+
+
+class IngestJobQueue:
+    """In-process queue running at most `concurrency` ingest jobs at a time.
+
+    Jobs run `ingest(doc_paths, job)` in a worker thread. The worker tasks are
+    started on the first submitted job, inside the service event loop.
+    """
+
+    def __init__(
+        self,
+        ingest: Callable[[List[DocPath], IngestJob], List[dict]],
+        concurrency: int = INGEST_JOB_CONCURRENCY,
+        history: int = INGEST_JOB_HISTORY,
+    ):
+        self.ingest = ingest
+        self.concurrency = concurrency
+        self.history = history
+        self.jobs = OrderedDict()
+        self._queue = None
+        self._workers = []
+
+    def _ensure_workers(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    def _evict(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[: max(len(self.jobs) - self.history, 0)]:
+            del self.jobs[job_id]
+
+    def submit(self, doc_paths: List[DocPath]) -> IngestJob:
+        self._ensure_workers()
+        job = IngestJob(doc_paths)
+        self.jobs[job.job_id] = job
+        self._evict()
+        self._queue.put_nowait(job)
+        if logflag:
+            logger.info(f"[ ingest jobs ] queued job {job.job_id} with {len(doc_paths)} files")
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        return self.jobs.get(job_id)
+
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            job.stage = "running"
+            job.started_at = time.time()
+            try:
+                job.files = await loop.run_in_executor(None, self.ingest, job.doc_paths, job)
+                failed = [status for status in job.files if status["status"] == "failed"]
+                job.stage = "failed" if failed else "succeeded"
+            except Exception as e:
+                logger.error(f"[ ingest jobs ] job {job.job_id} failed: {e}")
+                job.stage = "failed"
+                job.error = str(e)
+            finally:
+                job.finished_at = time.time()
+                self._queue.task_done()
+            if logflag:
+                logger.info(f"[ ingest jobs ] job {job.job_id} {job.stage}")
@@ -66,27 +66,41 @@ class LightDocumentProcessor:
         sentences = re.split(r'[.!?]+', text)
         
         current_chunk = ""
+        # character offset of the current chunk within the cleaned page text
+        chunk_start = 0
+        chunk_end = 0
+        cursor = 0
         for sentence in sentences:
             sentence = sentence.strip()
             if not sentence:
                 continue
+            sentence_start = text.find(sentence, cursor)
+            cursor = sentence_start + len(sentence)
                 
             # If adding this sentence would exceed chunk size, save current chunk
             if len(current_chunk) + len(sentence) > self.chunk_size and current_chunk:
                 chunks.append({
                     'text': current_chunk.strip(),
                     'page': page_num,
+                    'start_index': chunk_start,
+                    'end_index': chunk_end,
                     'source': f"page_{page_num}"
                 })
                 current_chunk = sentence
+                chunk_start = sentence_start
             else:
+                if not current_chunk:
+                    chunk_start = sentence_start
                 current_chunk += (" " + sentence if current_chunk else sentence)
+            chunk_end = cursor
         
         # Add final chunk if it exists
         if current_chunk.strip():
             chunks.append({
                 'text': current_chunk.strip(),
                 'page': page_num,
+                'start_index': chunk_start,
+                'end_index': chunk_end,
                 'source': f"page_{page_num}"
             })
         
@@ -1,32 +1,59 @@
 # Copyright (C) 2024 Intel Corporation
 # SPDX-License-Identifier: Apache-2.0
 
+import asyncio
+import base64
 import json
+import multiprocessing
 import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import List, Optional, Union
+from typing import Callable, List, Optional, Union
 import requests
 
-# from pyspark import SparkConf, SparkContext
 import redis
-from config import EMBED_MODEL, INDEX_NAME, KEY_INDEX_NAME, REDIS_URL, SEARCH_BATCH_SIZE
+from config import (
+    CHUNK_HASH_PREFIX,
+    CHUNK_MAP_PREFIX,
+    CORPUS_VERSION_KEY,
+    FILE_COUNT_KEY,
+    FILE_LIST_CURSOR_IDLE_MS,
+    FILE_LIST_MAX_PAGE_SIZE,
+    FILE_LIST_PAGE_SIZE,
+    INDEX_NAME,
+    INDEX_SCHEMA,
+    INGEST_BATCH_SIZE,
+    INGEST_FLUSH_SIZE,
+    INGEST_QUEUE_SIZE,
+    INGEST_WORKERS,
+    KEY_INDEX_NAME,
+    LOCAL_STORE_PATH,
+    REDIS_URL,
+    VECTOR_INDEX_OVERRIDES,
+)
+from embedder import embedder_registry
 from fastapi import Body, File, Form, HTTPException, UploadFile
+from fastapi.responses import JSONResponse
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import HuggingFaceBgeEmbeddings
 from langchain_community.vectorstores import Redis
-from langchain_huggingface import HuggingFaceEndpointEmbeddings
 from langchain_text_splitters import HTMLHeaderTextSplitter
 from redis.commands.search.field import TextField
 from redis.commands.search.indexDefinition import IndexDefinition, IndexType
+from redis.exceptions import ResponseError
 
 import os
 
 from groq import Groq
 from utils import (
     create_upload_folder,
+    decode_filename,
     document_loader,
     encode_filename,
-    format_search_results,
+    file_sha256,
     get_separators,
     get_tables_result,
     parse_html_new,
@@ -35,22 +62,32 @@ from utils import (
 )
 
 from comps import CustomLogger, DocPath, opea_microservices, register_microservice
+from comps.core.redis_schema import IndexSchema
+from comps.retriever.local_store import LocalVectorStore
 from comps.parsers.treeparser import TreeParser
 from comps.parsers.tree import Tree
 from comps.parsers.node import Node
 from comps.parsers.text import Text
 from comps.parsers.table import Table
+from jobs import IngestJob, IngestJobQueue
 from light_processor import LightDocumentProcessor
+from redis_writer import DELETE_CHUNK_SCRIPT, BulkChunkWriter, chunk_hash, lookup_chunk_vectors
 
 
 logger = CustomLogger("prepare_doc_redis")
 logflag = os.getenv("LOGFLAG", False)
 use_light_processing = os.getenv("USE_LIGHT_PROCESSING", "true").lower() == "true"
 
-tei_embedding_endpoint = os.getenv("TEI_ENDPOINT")
 upload_folder = "./uploaded_files/"
 redis_pool = redis.ConnectionPool.from_url(REDIS_URL)
+index_schema = IndexSchema.from_yaml(INDEX_SCHEMA, VECTOR_INDEX_OVERRIDES)
+local_store = LocalVectorStore(LOCAL_STORE_PATH) if LOCAL_STORE_PATH else None
 tree_parser = TreeParser()
+# created at startup and reused afterwards, dropped for good once a worker died
+parse_pool = None
+parse_pool_broken = False
+parse_pool_lock = threading.Lock()
+
 
 def check_index_existance(client):
     if logflag:
@@ -81,11 +118,14 @@ def create_index(client, index_name: str = KEY_INDEX_NAME):
     return True
 
 
-def store_by_id(client, key, value):
+def store_by_id(client, key, value, file_hash=None):
     if logflag:
         logger.info(f"[ store by id ] storing ids of {key}")
+    fields = {"file_name": key, "key_ids": value}
+    if file_hash:
+        fields["file_hash"] = file_hash
     try:
-        client.add_document(doc_id="file:" + key, file_name=key, key_ids=value)
+        client.add_document(doc_id="file:" + key, **fields)
         if logflag:
             logger.info(f"[ store by id ] store document success. id: file:{key}")
     except Exception as e:
@@ -135,53 +175,254 @@ def delete_by_id(client, id):
     return True
 
 
-def ingest_chunks_to_redis(file_name: str, chunks: List):
-    if logflag:
-        logger.info(f"[ ingest chunks ] file name: {file_name}")
-    # Create vectorstore
-    if tei_embedding_endpoint:
-        # create embeddings using TEI endpoint service
-        embedder = HuggingFaceEndpointEmbeddings(model=tei_embedding_endpoint)
-    else:
-        # create embeddings using local embedding model
-        embedder = HuggingFaceBgeEmbeddings(model_name=EMBED_MODEL)
+def ensure_file_count(r) -> int:
+    """Number of ingested files, kept in `FILE_COUNT_KEY` and seeded from the file-keys index when missing.
 
-    # Batch size
-    batch_size = 32
-    num_chunks = len(chunks)
+    Called before every increment or decrement, while the file key being
+    added or removed is not yet reflected in the index, so a corpus ingested
+    before the counter existed is counted right.
+    """
+    count = r.get(FILE_COUNT_KEY)
+    if count is None:
+        try:
+            num_docs = int(r.ft(KEY_INDEX_NAME).info()["num_docs"])
+        except ResponseError:
+            num_docs = 0
+        r.set(FILE_COUNT_KEY, num_docs, nx=True)
+        count = r.get(FILE_COUNT_KEY)
+    return int(count)
 
-    file_ids = []
-    for i in range(0, num_chunks, batch_size):
-        if logflag:
-            logger.info(f"[ ingest chunks ] Current batch: {i}")
-        batch_chunks = chunks[i : i + batch_size]
-        batch_texts = batch_chunks
-
-        _, keys = Redis.from_texts_return_keys(
-            texts=batch_texts,
-            embedding=embedder,
-            index_name=INDEX_NAME,
-            redis_url=REDIS_URL,
-        )
-        if logflag:
-            logger.info(f"[ ingest chunks ] keys: {keys}")
-        file_ids.extend(keys)
-        if logflag:
-            logger.info(f"[ ingest chunks ] Processed batch {i//batch_size + 1}/{(num_chunks-1)//batch_size + 1}")
 
-    # store file_ids into index file-keys
+def delete_chunks(r, chunk_ids: List[str], file_key: Optional[str] = None, atomic: bool = False) -> dict:
+    """Delete chunk hashes, their chunk sources and optionally a file-keys entry in one round trip.
+
+    The chunk-hash registry entry of a deleted chunk is removed too, when it
+    still points to that chunk. With `atomic` the deletes run in a MULTI/EXEC
+    transaction. Chunks already gone are reported as missing instead of
+    failing the whole delete.
+    """
+    if file_key:
+        ensure_file_count(r)
+    delete_chunk = r.register_script(DELETE_CHUNK_SCRIPT)
+    pipe = r.pipeline(transaction=atomic)
+    for chunk_id in chunk_ids:
+        delete_chunk(keys=[chunk_id], args=[CHUNK_HASH_PREFIX], client=pipe)
+    if chunk_ids:
+        pipe.delete(*[CHUNK_MAP_PREFIX + chunk_id for chunk_id in chunk_ids])
+    if file_key:
+        pipe.delete(file_key)
+        pipe.decr(FILE_COUNT_KEY)
+    # answers cached from the deleted chunks are no longer served
+    pipe.incr(CORPUS_VERSION_KEY)
+    results = pipe.execute(raise_on_error=False)
+    if local_store:
+        local_store.delete(chunk_ids)
+
+    report = {"deleted": [], "missing": [], "failed": []}
+    for chunk_id, result in zip(chunk_ids, results):
+        if isinstance(result, Exception):
+            report["failed"].append(chunk_id)
+        else:
+            report["deleted" if result else "missing"].append(chunk_id)
+    if file_key and isinstance(results[-3], Exception):
+        report["failed"].append(file_key)
+    return report
+
+
+def drop_chunk_sources(r, scan_count: int = 1000, prefix: str = CHUNK_MAP_PREFIX):
+    """Remove the whole chunk id -> source file mapping, or the keys of another chunk-level `prefix`."""
+    pipe = r.pipeline(transaction=False)
+    for key in r.scan_iter(match=prefix + "*", count=scan_count):
+        pipe.delete(key)
+        if len(pipe) >= scan_count:
+            pipe.execute()
+    pipe.execute()
+
+
+def build_chunk_metadata(file_name: str, chunks: List, metadatas: Optional[List[dict]] = None) -> List[dict]:
+    """Provenance fields stored on every chunk hash, see `redis_schema_multi.yml`.
+
+    Unknown values are left out instead of stored empty, since an empty NUMERIC
+    field would make Redis skip the whole chunk when indexing.
+    """
+    chunk_metadatas = []
+    for i, chunk in enumerate(chunks):
+        metadata = {"file_name": file_name, "chunk_index": i}
+        if metadatas:
+            metadata.update({k: v for k, v in metadatas[i].items() if v is not None})
+        chunk_metadatas.append(metadata)
+    return chunk_metadatas
+
+
+_EMBED_DONE = object()
+
+
+def iter_embedded_batches(embedder, chunks: List, batch_size: int, queue_size: int = INGEST_QUEUE_SIZE):
+    """Yield `(offset, texts, embeddings)` per batch, embedding the next batches on a worker thread.
+
+    The caller writes batch N while batch N+1 is being embedded. The bounded
+    queue keeps the embedder at most `queue_size` batches ahead of the caller.
+    """
+    batches = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def produce():
+        try:
+            for i in range(0, len(chunks), batch_size):
+                if stop.is_set():
+                    return
+                texts = chunks[i : i + batch_size]
+                put((i, texts, embedder.embed_documents(texts)))
+        except Exception as e:
+            put(e)
+            return
+        put(_EMBED_DONE)
+
+    worker = threading.Thread(target=produce, name="ingest-embedder", daemon=True)
+    worker.start()
+    try:
+        while True:
+            item = batches.get()
+            if item is _EMBED_DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        worker.join()
+
+
+def match_previous_chunks(r, previous_keys: List[str], hashes: List[str]):
+    """Pair the chunks of the previous version of a file with the new chunks of identical content.
+
+    Returns `(kept, stale)`: the existing key reused by every matched chunk
+    index, and the previous keys left without a match.
+    """
+    pipe = r.pipeline(transaction=False)
+    for key in previous_keys:
+        pipe.hget(key, "chunk_hash")
+    previous_hashes = pipe.execute()
+
+    unmatched = {}
+    for i, h in enumerate(hashes):
+        unmatched.setdefault(h, []).append(i)
+    kept, stale = {}, []
+    for key, h in zip(previous_keys, previous_hashes):
+        h = h.decode() if isinstance(h, bytes) else h
+        if h and unmatched.get(h):
+            kept[unmatched[h].pop(0)] = key
+        else:
+            stale.append(key)
+    return kept, stale
+
+
+def ingest_chunks_to_redis(
+    file_name: str,
+    chunks: List,
+    metadatas: Optional[List[dict]] = None,
+    progress: Optional[Callable[[int], None]] = None,
+    previous_keys: Optional[List[str]] = None,
+    file_hash: Optional[str] = None,
+) -> dict:
+    """Write the chunks of a file, embedding only content not in the index yet.
+
+    Chunks of `previous_keys` (the previous version of the file) with unchanged
+    content are kept in place with refreshed metadata, chunks whose content is
+    stored elsewhere in the index reuse its embedding, and previous chunks
+    without a match are deleted. Returns how many chunks went each way.
+    """
+    if logflag:
+        logger.info(f"[ ingest chunks ] file name: {file_name}")
+    start = time.time()
+    hashes = [chunk_hash(chunk) for chunk in chunks]
+    chunk_metadatas = build_chunk_metadata(file_name, chunks, metadatas)
+    for metadata, h in zip(chunk_metadatas, hashes):
+        metadata["chunk_hash"] = h
     r = redis.Redis(connection_pool=redis_pool)
+    writer = BulkChunkWriter(
+        r, index_schema, index_name=INDEX_NAME, flush_size=INGEST_FLUSH_SIZE, local_store=local_store
+    )
+
+    file_ids = [None] * len(chunks)
+    kept, stale = match_previous_chunks(r, previous_keys, hashes) if previous_keys else ({}, [])
+    for i, key in kept.items():
+        writer.update(key, chunk_metadatas[i])
+        file_ids[i] = key
+
+    # chunks to write, grouped by content so repeated chunks are embedded once
+    pending = {}
+    for i, h in enumerate(hashes):
+        if i not in kept:
+            pending.setdefault(h, []).append(i)
+    stored = lookup_chunk_vectors(r, pending, index_schema)
+
+    def write(h, vector):
+        indices = pending[h]
+        keys = writer.add([chunks[i] for i in indices], [vector] * len(indices), [chunk_metadatas[i] for i in indices])
+        for i, key in zip(indices, keys):
+            file_ids[i] = key
+        return len(keys)
+
+    reused = sum(write(h, vector) for h, vector in stored.items())
+    if progress:
+        progress(len(kept) + reused)
+
+    to_embed = [h for h in pending if h not in stored]
+    texts = [chunks[pending[h][0]] for h in to_embed]
+    batch_size = INGEST_BATCH_SIZE
+    embedded = 0
+    if texts:
+        embedder = embedder_registry.get()
+        for i, batch_texts, embeddings in iter_embedded_batches(embedder, texts, batch_size):
+            if logflag:
+                logger.info(f"[ ingest chunks ] Current batch: {i}")
+            written = sum(write(h, vector) for h, vector in zip(to_embed[i : i + batch_size], embeddings))
+            embedded += len(embeddings)
+            if progress:
+                progress(written)
+            if logflag:
+                logger.info(f"[ ingest chunks ] Processed batch {i//batch_size + 1}/{(len(texts)-1)//batch_size + 1}")
+    stats = writer.close()
+    logger.info(
+        f"[ ingest chunks ] {file_name}: {len(chunks)} chunks ({embedded} embedded, {reused} reused, "
+        f"{len(kept)} unchanged, {len(stale)} removed) in {time.time() - start:.2f}s, "
+        f"writes took {stats['write_seconds']:.2f}s "
+        f"({stats['chunks_per_second']:.1f} chunks/s, {stats['bytes_per_second'] / 1e6:.2f} MB/s)"
+    )
+
+    # store file_ids into index file-keys
     client = r.ft(KEY_INDEX_NAME)
     if not check_index_existance(client):
         assert create_index(client)
+    if previous_keys is None:
+        ensure_file_count(r)
 
     try:
-        assert store_by_id(client, key=file_name, value="#".join(file_ids))
+        assert store_by_id(client, key=file_name, value="#".join(file_ids), file_hash=file_hash)
     except Exception as e:
         if logflag:
             logger.info(f"[ ingest chunks ] {e}. Fail to store chunks of file {file_name}.")
         raise HTTPException(status_code=500, detail=f"Fail to store chunks of file {file_name}.")
-    return True
+
+    if previous_keys is None:
+        r.incr(FILE_COUNT_KEY)
+    if embedded or reused:
+        r.incr(CORPUS_VERSION_KEY)
+
+    # drop the chunks of the previous version only once the new key list is stored
+    if stale:
+        delete_chunks(r, stale)
+    return {"chunks": len(chunks), "embedded": embedded, "reused": reused, "unchanged": len(kept), "removed": len(stale)}
+
 
 def get_table_description(item: Table):
     server_host_ip = os.getenv("SERVER_HOST_IP", "vllm-service")
@@ -248,8 +489,11 @@ def create_chunks(node: Node, text_splitter: RecursiveCharacterTextSplitter):
         node_chunks.extend(create_chunks(node.get_child(i), text_splitter))
     return node_chunks
 
-def ingest_data_to_redis(doc_path: DocPath):
-    """Ingest document to Redis."""
+def parse_document(doc_path: DocPath):
+    """Parse and chunk a document, return `(file_name, chunks, metadatas)`.
+
+    Runs in the parse worker processes for multi-file uploads.
+    """
     path = doc_path.path
     if logflag:
         logger.info(f"[ ingest data ] Parsing document {path}.")
@@ -270,6 +514,10 @@ def ingest_data_to_redis(doc_path: DocPath):
         
         document_chunks = light_processor.process_document(path)
         chunks = [chunk['text'] for chunk in document_chunks]
+        metadatas = [
+            {"page": chunk['page'], "start_index": chunk['start_index'], "end_index": chunk['end_index']}
+            for chunk in document_chunks
+        ]
         
         logger.info(f"[ ingest data ] Light processing completed. Created {len(chunks)} chunks.")
     else:
@@ -279,9 +527,190 @@ def ingest_data_to_redis(doc_path: DocPath):
         tree_parser = TreeParser()
         tree_parser.populate_tree(tree)
         chunks = create_chunks(tree.rootNode, text_splitter)
+        metadatas = None
 
     file_name = doc_path.path.split("/")[-1]
-    return ingest_chunks_to_redis(file_name, chunks)
+    return file_name, chunks, metadatas
+
+
+def ingest_data_to_redis(doc_path: DocPath):
+    """Ingest document to Redis."""
+    return ingest_chunks_to_redis(*parse_document(doc_path))
+
+
+def get_parse_pool(workers: int) -> Optional[ProcessPoolExecutor]:
+    """Pool of parsing processes, started at service startup while the process is still single-threaded.
+
+    Workers are forked: spawn or forkserver children re-import this module,
+    which would register the microservice and bind its port again. Forking
+    once the embedder loader, the ingest threads or torch hold locks can
+    deadlock the children, so every worker is forked up front. For the same
+    reasons a pool broken by a dead worker is not replaced: None is returned
+    and documents are parsed in the request thread until the service restarts.
+    """
+    global parse_pool
+    with parse_pool_lock:
+        if parse_pool is None and not parse_pool_broken:
+            parse_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"))
+            # worker processes are only created on submit
+            wait([parse_pool.submit(os.getpid) for _ in range(workers)])
+    return parse_pool
+
+
+def ingest_files_to_redis(doc_paths: List[DocPath], job: Optional[IngestJob] = None) -> List[dict]:
+    """Ingest several documents, parsing them in parallel.
+
+    Documents are parsed and chunked in up to `INGEST_WORKERS` processes and
+    embedded by the shared embedder as soon as their chunks are ready. A
+    document already ingested under the same name is skipped when its content
+    hash is unchanged and otherwise updated in place. Returns the ingest status
+    of every document, in upload order. Progress is reported to `job` when given.
+    """
+    statuses = [{"file": decode_filename(doc_path.path.split("/")[-1])} for doc_path in doc_paths]
+    if job:
+        job.stage = "parsing"
+
+    client = redis.Redis(connection_pool=redis_pool).ft(KEY_INDEX_NAME)
+    file_hashes, previous_keys, pending = {}, {}, []
+    for i, doc_path in enumerate(doc_paths):
+        file_hashes[i] = file_sha256(doc_path.path)
+        previous = search_by_id(client, "file:" + doc_path.path.split("/")[-1])
+        if previous is not None and getattr(previous, "key_ids", None):
+            if getattr(previous, "file_hash", None) == file_hashes[i]:
+                statuses[i].update({"status": "unchanged", "chunks": len(previous.key_ids.split("#"))})
+                if job:
+                    job.file_parsed(0)
+                continue
+            previous_keys[i] = previous.key_ids.split("#")
+        pending.append(i)
+
+    workers = min(INGEST_WORKERS, len(pending))
+    pool = get_parse_pool(INGEST_WORKERS) if workers > 1 else None
+    if pool is None:
+        results = ((i, _parse_or_error(doc_paths[i])) for i in pending)
+    else:
+        results = _parse_in_pool(pool, doc_paths, pending)
+
+    for i, parsed in results:
+        status = statuses[i]
+        try:
+            if isinstance(parsed, Exception):
+                raise parsed
+            file_name, chunks, metadatas = parsed
+            if job:
+                job.file_parsed(len(chunks))
+                job.stage = "ingesting"
+            stats = ingest_chunks_to_redis(
+                file_name,
+                chunks,
+                metadatas,
+                progress=job.advance if job else None,
+                previous_keys=previous_keys.get(i),
+                file_hash=file_hashes[i],
+            )
+            status.update({"status": "updated" if i in previous_keys else "succeeded", **stats})
+        except Exception as e:
+            logger.error(f"[ ingest data ] fail to ingest {status['file']}: {e}")
+            status.update({"status": "failed", "error": getattr(e, "detail", str(e))})
+    return statuses
+
+
+def _parse_or_error(doc_path: DocPath):
+    try:
+        return parse_document(doc_path)
+    except Exception as e:
+        return e
+
+
+def _parse_in_pool(pool: ProcessPoolExecutor, doc_paths: List[DocPath], pending: List[int]):
+    """Yield `(index, parsed document or error)` as the pool finishes them.
+
+    Documents lost to a dead worker (out of memory, crash in a parser) are
+    parsed in this thread, and the broken pool is dropped.
+    """
+    global parse_pool, parse_pool_broken
+    futures = {}
+    try:
+        for i in pending:
+            futures[pool.submit(parse_document, doc_paths[i])] = i
+    except BrokenProcessPool:
+        pass
+    lost = [i for i in pending if i not in futures.values()]
+    for future in as_completed(futures):
+        try:
+            yield futures[future], future.result()
+        except BrokenProcessPool:
+            lost.append(futures[future])
+        except Exception as e:
+            yield futures[future], e
+
+    if lost:
+        with parse_pool_lock:
+            if parse_pool is pool:
+                parse_pool, parse_pool_broken = None, True
+                logger.error(
+                    "[ ingest data ] a parse worker died, documents are parsed in the request thread "
+                    "until the service restarts"
+                )
+        pool.shutdown(wait=False)
+    for i in lost:
+        yield i, _parse_or_error(doc_paths[i])
+
+
+# background ingests submitted through /v1/dataprep/jobs
+ingest_jobs = IngestJobQueue(ingest_files_to_redis)
+
+
+async def save_uploaded_files(
+    client,
+    files: Union[UploadFile, List[UploadFile]],
+    chunk_size: int,
+    chunk_overlap: int,
+    process_table: bool,
+    table_strategy: str,
+    update: bool = False,
+) -> List[DocPath]:
+    """Check that none of `files` exists yet unless `update` is set, then save them to the upload folder."""
+    if not isinstance(files, list):
+        files = [files]
+    doc_paths = []
+
+    # check all files before saving any of them
+    for file in files:
+        encode_file = encode_filename(file.filename)
+        doc_id = "file:" + encode_file
+        if logflag:
+            logger.info(f"[ upload ] processing file {doc_id}")
+
+        # check whether the file already exists
+        key_ids = None
+        try:
+            key_ids = search_by_id(client, doc_id).key_ids
+            if logflag:
+                logger.info(f"[ upload ] File {file.filename} already exists.")
+        except Exception as e:
+            logger.info(f"[ upload ] File {file.filename} does not exist.")
+        if key_ids and not update:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Uploaded file {file.filename} already exists. Please change file name or set update=true.",
+            )
+
+    for file in files:
+        save_path = upload_folder + encode_filename(file.filename)
+        await save_content_to_local_disk(save_path, file)
+        doc_paths.append(
+            DocPath(
+                path=save_path,
+                chunk_size=chunk_size,
+                chunk_overlap=chunk_overlap,
+                process_table=process_table,
+                table_strategy=table_strategy,
+            )
+        )
+        if logflag:
+            logger.info(f"[ upload ] Successfully saved file {save_path}")
+    return doc_paths
 
 
 @register_microservice(name="opea_service@prepare_doc_redis", endpoint="/v1/dataprep", host="0.0.0.0", port=6007)
@@ -292,6 +721,7 @@ async def ingest_documents(
     chunk_overlap: int = Form(100),
     process_table: bool = Form(False),
     table_strategy: str = Form("fast"),
+    update: bool = Form(False),
 ):
     if logflag:
         logger.info(f"[ upload ] files:{files}")
@@ -301,69 +731,20 @@ async def ingest_documents(
     client = r.ft(KEY_INDEX_NAME)
 
     if files:
-        if not isinstance(files, list):
-            files = [files]
-        uploaded_files = []
-
-        for file in files:
-            encode_file = encode_filename(file.filename)
-            doc_id = "file:" + encode_file
-            if logflag:
-                logger.info(f"[ upload ] processing file {doc_id}")
-
-            # check whether the file already exists
-            key_ids = None
-            try:
-                key_ids = search_by_id(client, doc_id).key_ids
-                if logflag:
-                    logger.info(f"[ upload ] File {file.filename} already exists.")
-            except Exception as e:
-                logger.info(f"[ upload ] File {file.filename} does not exist.")
-            if key_ids:
-                raise HTTPException(
-                    status_code=400, detail=f"Uploaded file {file.filename} already exists. Please change file name."
-                )
+        doc_paths = await save_uploaded_files(
+            client, files, chunk_size, chunk_overlap, process_table, table_strategy, update
+        )
 
-            save_path = upload_folder + encode_file
-            await save_content_to_local_disk(save_path, file)
-            ingest_data_to_redis(
-                DocPath(
-                    path=save_path,
-                    chunk_size=chunk_size,
-                    chunk_overlap=chunk_overlap,
-                    process_table=process_table,
-                    table_strategy=table_strategy,
-                )
-            )
-            uploaded_files.append(save_path)
-            if logflag:
-                logger.info(f"[ upload ] Successfully saved file {save_path}")
-
-        # def process_files_wrapper(files):
-        #     if not isinstance(files, list):
-        #         files = [files]
-        #     for file in files:
-        #         ingest_data_to_redis(DocPath(path=file, chunk_size=chunk_size, chunk_overlap=chunk_overlap))
-
-        # try:
-        #     # Create a SparkContext
-        #     conf = SparkConf().setAppName("Parallel-dataprep").setMaster("local[*]")
-        #     sc = SparkContext(conf=conf)
-        #     # Create an RDD with parallel processing
-        #     parallel_num = min(len(uploaded_files), os.cpu_count())
-        #     rdd = sc.parallelize(uploaded_files, parallel_num)
-        #     # Perform a parallel operation
-        #     rdd_trans = rdd.map(process_files_wrapper)
-        #     rdd_trans.collect()
-        #     # Stop the SparkContext
-        #     sc.stop()
-        # except:
-        #     # Stop the SparkContext
-        #     sc.stop()
-        result = {"status": 200, "message": "Data preparation succeeded"}
+        # parsing, embedding and writing are blocking, keep them off the event loop
+        statuses = await asyncio.get_running_loop().run_in_executor(None, ingest_files_to_redis, doc_paths)
+        failed = [status["file"] for status in statuses if status["status"] == "failed"]
+        if failed:
+            result = {"status": 500, "message": f"Data preparation failed for {', '.join(failed)}", "files": statuses}
+        else:
+            result = {"status": 200, "message": "Data preparation succeeded", "files": statuses}
         if logflag:
             logger.info(result)
-        return result
+        return JSONResponse(status_code=result["status"], content=result)
 
     # if link_list:
     #     link_list = json.loads(link_list)  # Parse JSON string to list
@@ -407,6 +788,127 @@ async def ingest_documents(
     raise HTTPException(status_code=400, detail="Must provide either a file or a string list.")
 
 
+@register_microservice(name="opea_service@prepare_doc_redis", endpoint="/v1/dataprep/jobs", host="0.0.0.0", port=6007)
+async def submit_ingest_job(
+    files: Union[UploadFile, List[UploadFile]] = File(...),
+    chunk_size: int = Form(1500),
+    chunk_overlap: int = Form(100),
+    process_table: bool = Form(False),
+    table_strategy: str = Form("fast"),
+    update: bool = Form(False),
+):
+    """Save the uploaded files and ingest them in the background.
+
+    Returns the job id right away, progress is polled from `/v1/dataprep/jobs/{job_id}`.
+    """
+    r = redis.Redis(connection_pool=redis_pool)
+    doc_paths = await save_uploaded_files(
+        r.ft(KEY_INDEX_NAME), files, chunk_size, chunk_overlap, process_table, table_strategy, update
+    )
+    job = ingest_jobs.submit(doc_paths)
+    return JSONResponse(
+        status_code=202, content={"job_id": job.job_id, "status_url": f"/v1/dataprep/jobs/{job.job_id}"}
+    )
+
+
+@register_microservice(
+    name="opea_service@prepare_doc_redis",
+    endpoint="/v1/dataprep/jobs/{job_id}",
+    host="0.0.0.0",
+    port=6007,
+    methods=["GET"],
+)
+async def get_ingest_job(job_id: str):
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Ingest job {job_id} not found.")
+    return job.to_dict()
+
+
+FILE_FIELDS = ("file_name", "key_ids", "file_hash")
+
+
+def encode_cursor(cursor_id: int) -> Optional[str]:
+    if not cursor_id:
+        return None
+    return base64.urlsafe_b64encode(json.dumps({"index": KEY_INDEX_NAME, "id": cursor_id}).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        index, cursor_id = state["index"], int(state["id"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    if index != KEY_INDEX_NAME:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    return cursor_id
+
+
+def list_files_page(r, limit: int, fields: List[str], cursor: Optional[str] = None):
+    """Read one page of the file-keys index through an FT.AGGREGATE cursor.
+
+    Each page costs one round trip whatever its position in the listing.
+    Returns the files of the page and the cursor of the next one, None on the
+    last page.
+    """
+    try:
+        if cursor:
+            response = r.execute_command("FT.CURSOR", "READ", KEY_INDEX_NAME, decode_cursor(cursor), "COUNT", limit)
+        else:
+            load = [f"@{field}" for field in dict.fromkeys(["file_name", *fields])]
+            args = ["LOAD", len(load), *load, "WITHCURSOR", "COUNT", limit, "MAXIDLE", FILE_LIST_CURSOR_IDLE_MS]
+            response = r.execute_command("FT.AGGREGATE", KEY_INDEX_NAME, "*", *args)
+    except ResponseError as e:
+        if cursor and "cursor" in str(e).lower():
+            raise HTTPException(status_code=410, detail="Cursor expired, restart the listing without a cursor.")
+        if "no such index" in str(e).lower() or "unknown index" in str(e).lower():
+            return [], None
+        raise
+
+    rows, cursor_id = response
+    files = []
+    for row in rows[1:]:
+        values = {row[i].decode(): row[i + 1].decode() for i in range(0, len(row), 2)}
+        name = decode_filename(values["file_name"])
+        file = {"name": name, "id": name, "type": "File", "parent": ""}
+        file.update({field: values.get(field) for field in fields if field != "file_name"})
+        files.append(file)
+    return files, encode_cursor(cursor_id)
+
+
+@register_microservice(
+    name="opea_service@prepare_doc_redis",
+    endpoint="/v1/dataprep/list_files",
+    host="0.0.0.0",
+    port=6007,
+    methods=["GET"],
+)
+async def list_files(
+    cursor: Optional[str] = None,
+    limit: int = FILE_LIST_PAGE_SIZE,
+    fields: str = "file_name",
+    with_total: bool = False,
+):
+    """Page through the ingested files.
+
+    `cursor`: the `next_cursor` of the previous page, omitted for the first page
+    `limit`: number of files per page, at most `FILE_LIST_MAX_PAGE_SIZE`
+    `fields`: comma separated fields returned for every file, among `file_name`, `key_ids` and `file_hash`
+    `with_total`: also return the number of ingested files
+    """
+    fields = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in fields if field not in FILE_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields {unknown}, expected some of {list(FILE_FIELDS)}.")
+    if not 0 < limit <= FILE_LIST_MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit should be between 1 and {FILE_LIST_MAX_PAGE_SIZE}.")
+
+    r = redis.Redis(connection_pool=redis_pool)
+    files, next_cursor = list_files_page(r, limit, fields, cursor)
+    return {"files": files, "next_cursor": next_cursor, "total": ensure_file_count(r) if with_total else None}
+
+
 @register_microservice(
     name="opea_service@prepare_doc_redis", endpoint="/v1/dataprep/get_file", host="0.0.0.0", port=6007
 )
@@ -416,26 +918,10 @@ async def rag_get_file_structure():
 
     # define redis client
     r = redis.Redis(connection_pool=redis_pool)
-    offset = 0
-    file_list = []
-
-    # check index existence
-    res = check_index_existance(r.ft(KEY_INDEX_NAME))
-    if not res:
-        if logflag:
-            logger.info(f"[ get ] index {KEY_INDEX_NAME} does not exist")
-        return file_list
-
-    while True:
-        response = r.execute_command("FT.SEARCH", KEY_INDEX_NAME, "*", "LIMIT", offset, offset + SEARCH_BATCH_SIZE)
-        # no doc retrieved
-        if len(response) < 2:
-            break
-        file_list = format_search_results(response, file_list)
-        offset += SEARCH_BATCH_SIZE
-        # last batch
-        if (len(response) - 1) // 2 < SEARCH_BATCH_SIZE:
-            break
+    file_list, cursor = list_files_page(r, FILE_LIST_MAX_PAGE_SIZE, ["file_name"])
+    while cursor:
+        files, cursor = list_files_page(r, FILE_LIST_MAX_PAGE_SIZE, ["file_name"], cursor)
+        file_list.extend(files)
     if logflag:
         logger.info(f"[get] final file_list: {file_list}")
     return file_list
@@ -444,12 +930,13 @@ async def rag_get_file_structure():
 @register_microservice(
     name="opea_service@prepare_doc_redis", endpoint="/v1/dataprep/delete_file", host="0.0.0.0", port=6007
 )
-async def delete_single_file(file_path: str = Body(..., embed=True)):
+async def delete_single_file(file_path: str = Body(..., embed=True), atomic: bool = Body(False, embed=True)):
     """Delete file according to `file_path`.
 
     `file_path`:
         - specific file path (e.g. /path/to/file.txt)
         - "all": delete all files uploaded
+    `atomic`: delete the chunks of a specific file in a single MULTI/EXEC transaction
     """
 
     # define redis client
@@ -485,6 +972,20 @@ async def delete_single_file(file_path: str = Body(..., embed=True)):
             if logflag:
                 logger.info(f"[ delete ] Index {INDEX_NAME} does not exits.")
 
+        # drop chunk id -> file name mapping, the chunk content registry and the file count
+        try:
+            drop_chunk_sources(r)
+            drop_chunk_sources(r, prefix=CHUNK_HASH_PREFIX)
+            r.delete(FILE_COUNT_KEY)
+            # incremented rather than deleted, so the version never goes back to one already cached
+            r.incr(CORPUS_VERSION_KEY)
+            if local_store:
+                local_store.clear()
+        except Exception as e:
+            if logflag:
+                logger.info(f"[ delete ] {e}. Fail to drop chunk sources.")
+            raise HTTPException(status_code=500, detail="Fail to drop chunk sources.")
+
         # delete files on local disk
         try:
             remove_folder_with_ignore(upload_folder)
@@ -517,37 +1018,32 @@ async def delete_single_file(file_path: str = Body(..., embed=True)):
         raise HTTPException(status_code=404, detail=f"File not found in db {KEY_INDEX_NAME}. Please check file_path.")
     file_ids = key_ids.split("#")
 
-    # delete file keys id in db KEY_INDEX_NAME
+    # delete the file keys entry, the file content in db INDEX_NAME and the chunk sources together
     try:
-        assert delete_by_id(client, doc_id)
+        report = delete_chunks(r, file_ids, file_key=doc_id, atomic=atomic)
     except Exception as e:
         if logflag:
-            logger.info(f"[ delete ] {e}. File {file_path} delete failed for db {KEY_INDEX_NAME}.")
-        raise HTTPException(status_code=500, detail=f"File {file_path} delete failed for key index.")
-
-    # delete file content in db INDEX_NAME
-    for file_id in file_ids:
-        # determine whether this file exists in db INDEX_NAME
-        try:
-            search_by_id(client2, file_id)
-        except Exception as e:
-            if logflag:
-                logger.info(f"[ delete ] {e}. File {file_path} does not exists.")
-            raise HTTPException(status_code=404, detail=f"File not found in db {INDEX_NAME}. Please check file_path.")
-
-        # delete file content
-        try:
-            assert delete_by_id(client2, file_id)
-        except Exception as e:
-            if logflag:
-                logger.info(f"[ delete ] {e}. File {file_path} delete failed for db {INDEX_NAME}")
-            raise HTTPException(status_code=500, detail=f"File {file_path} delete failed for index.")
+            logger.info(f"[ delete ] {e}. File {file_path} delete failed.")
+        raise HTTPException(status_code=500, detail=f"File {file_path} delete failed.")
+    if logflag:
+        logger.info(
+            f"[ delete ] {file_path}: {len(report['deleted'])} chunks deleted, "
+            f"{len(report['missing'])} missing, {len(report['failed'])} failed"
+        )
+    result = {
+        "status": not report["failed"],
+        "deleted_chunks": len(report["deleted"]),
+        "missing_chunks": report["missing"],
+        "failed": report["failed"],
+    }
+    if report["failed"]:
+        return JSONResponse(status_code=500, content=result)
 
     # local file does not exist (restarted docker container)
     if not delete_path.exists():
         if logflag:
             logger.info(f"[ delete ] File {file_path} not saved locally.")
-        return {"status": True}
+        return result
 
     # delete local file
     if delete_path.is_file():
@@ -555,7 +1051,7 @@ async def delete_single_file(file_path: str = Body(..., embed=True)):
         delete_path.unlink()
         if logflag:
             logger.info(f"[ delete ] File {file_path} deleted successfully.")
-        return {"status": True}
+        return result
 
     # delete folder
     else:
@@ -564,6 +1060,18 @@ async def delete_single_file(file_path: str = Body(..., embed=True)):
         raise HTTPException(status_code=404, detail=f"Delete folder {file_path} is not supported for now.")
 
 
+@register_microservice(
+    name="opea_service@prepare_doc_redis", endpoint="/v1/dataprep/ready", host="0.0.0.0", port=6007, methods=["GET"]
+)
+async def embedder_readiness():
+    """Report whether the embedding model is loaded and ingest requests can be served without delay."""
+    status = embedder_registry.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+
 if __name__ == "__main__":
     create_upload_folder(upload_folder)
+    # before any thread starts, see get_parse_pool
+    get_parse_pool(INGEST_WORKERS)
+    embedder_registry.start()
     opea_microservices["opea_service@prepare_doc_redis"].start()
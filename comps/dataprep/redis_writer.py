@@ -0,0 +1,184 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import hashlib
+import os
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from config import CHUNK_HASH_PREFIX, INDEX_NAME, INGEST_FLUSH_SIZE
+
+from comps import CustomLogger
+from comps.core.redis_schema import IndexSchema, index_exists
+from comps.retriever.local_store import LocalVectorStore
+
+logger = CustomLogger("redis_writer")
+logflag = os.getenv("LOGFLAG", False)
+
+
+# The chunk-hash registry maps the sha256 of a chunk content to the set of chunk keys storing it.
+# The scripts below also accept the single chunk key string entries written by earlier versions.
+
+# add a chunk key to the registry entry of its content
+REGISTER_CHUNK_SCRIPT = """
+if redis.call('TYPE', KEYS[1]).ok == 'string' then
+    local previous = redis.call('GET', KEYS[1])
+    redis.call('DEL', KEYS[1])
+    redis.call('SADD', KEYS[1], previous)
+end
+return redis.call('SADD', KEYS[1], ARGV[1])
+"""
+
+# stored vector of the first chunk still holding the content of a registry entry
+LOOKUP_CHUNK_SCRIPT = """
+local keys
+if redis.call('TYPE', KEYS[1]).ok == 'string' then
+    keys = {redis.call('GET', KEYS[1])}
+else
+    keys = redis.call('SMEMBERS', KEYS[1])
+end
+for _, key in ipairs(keys) do
+    local vector = redis.call('HGET', key, ARGV[1])
+    if vector then
+        return vector
+    end
+end
+return false
+"""
+
+# delete a chunk hash and remove it from the registry entry of its content, dropped with its last chunk
+DELETE_CHUNK_SCRIPT = """
+local h = redis.call('HGET', KEYS[1], 'chunk_hash')
+if h then
+    local registry = ARGV[1] .. h
+    local kind = redis.call('TYPE', registry).ok
+    if kind == 'set' then
+        redis.call('SREM', registry, KEYS[1])
+    elseif kind == 'string' and redis.call('GET', registry) == KEYS[1] then
+        redis.call('DEL', registry)
+    end
+end
+return redis.call('DEL', KEYS[1])
+"""
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def lookup_chunk_vectors(client, hashes: Iterable[str], schema: IndexSchema) -> Dict[str, bytes]:
+    """Return the stored embedding of every chunk hash already present in the index.
+
+    Registry entries pointing to deleted chunks are ignored.
+    """
+    hashes = list(dict.fromkeys(hashes))
+    if not hashes:
+        return {}
+    lookup = client.register_script(LOOKUP_CHUNK_SCRIPT)
+    pipe = client.pipeline(transaction=False)
+    for h in hashes:
+        lookup(keys=[CHUNK_HASH_PREFIX + h], args=[schema.vector_key], client=pipe)
+    return {h: vector for h, vector in zip(hashes, pipe.execute()) if vector}
+
+
+class BulkChunkWriter:
+    """Write chunk hashes to the vector index through one non-transactional pipeline.
+
+    Commands are buffered and sent every `flush_size` chunks, so ingest runs at
+    network speed instead of paying a connection setup and an index check per
+    batch. The index is created from `schema` on the first write if missing.
+    Chunks carrying a `chunk_hash` are registered so later ingests can reuse
+    their embedding. New chunks are also appended to `local_store` when given.
+    """
+
+    def __init__(
+        self,
+        client,
+        schema: IndexSchema,
+        index_name: str = INDEX_NAME,
+        flush_size: int = INGEST_FLUSH_SIZE,
+        local_store: Optional[LocalVectorStore] = None,
+    ):
+        self.client = client
+        self.local_store = local_store
+        self.schema = schema
+        self.index_name = index_name
+        self.key_prefix = f"doc:{index_name}"
+        self.flush_size = flush_size
+        self.chunks = 0
+        self.bytes = 0
+        # time spent sending buffered writes to Redis
+        self.write_seconds = 0.0
+        self._pipe = client.pipeline(transaction=False)
+        self._register = client.register_script(REGISTER_CHUNK_SCRIPT)
+        # chunk writes buffered in the pipeline, each one queues several commands
+        self._pending = 0
+        self._index_checked = False
+
+    def _ensure_index(self, dims: int):
+        if not index_exists(self.client, self.index_name):
+            if logflag:
+                logger.info(f"[ bulk writer ] creating index {self.index_name} with {dims} dims")
+            self.schema.create_index(self.client, self.index_name, prefix=self.key_prefix, dims=dims)
+        self._index_checked = True
+
+    def add(self, texts: List[str], embeddings: List[List[float]], metadatas: List[Dict]) -> List[str]:
+        """Queue one batch of chunks and return their keys."""
+        if embeddings and not self._index_checked:
+            self._ensure_index(self._dims(embeddings[0]))
+
+        keys = []
+        for text, embedding, metadata in zip(texts, embeddings, metadatas):
+            key = f"{self.key_prefix}:{uuid.uuid4().hex}"
+            # embeddings reused from the index are already encoded
+            vector = embedding if isinstance(embedding, bytes) else self.schema.vector_to_bytes(embedding)
+            self._pipe.hset(key, mapping={self.schema.content_key: text, self.schema.vector_key: vector, **metadata})
+            if "chunk_hash" in metadata:
+                self._register(keys=[CHUNK_HASH_PREFIX + metadata["chunk_hash"]], args=[key], client=self._pipe)
+            self.chunks += 1
+            self.bytes += len(text.encode("utf-8")) + len(vector)
+            keys.append(key)
+            self._pending += 1
+            if self._pending >= self.flush_size:
+                self.flush()
+        if self.local_store:
+            vectors = [
+                np.frombuffer(e, dtype=self.schema.vector_dtype) if isinstance(e, bytes) else e for e in embeddings
+            ]
+            self.local_store.append(keys, texts, vectors, metadatas)
+        return keys
+
+    def update(self, key: str, metadata: Dict):
+        """Queue a metadata update of an existing chunk."""
+        self._pipe.hset(key, mapping=metadata)
+        if "chunk_hash" in metadata:
+            self._register(keys=[CHUNK_HASH_PREFIX + metadata["chunk_hash"]], args=[key], client=self._pipe)
+        self._pending += 1
+        if self._pending >= self.flush_size:
+            self.flush()
+
+    def _dims(self, embedding) -> int:
+        if isinstance(embedding, bytes):
+            return len(embedding) // np.dtype(self.schema.vector_dtype).itemsize
+        return len(embedding)
+
+    def flush(self):
+        if len(self._pipe):
+            start = time.time()
+            self._pipe.execute()
+            self.write_seconds += time.time() - start
+        self._pending = 0
+
+    def close(self) -> Dict:
+        """Send the remaining writes and return the write throughput of this writer."""
+        self.flush()
+        seconds = max(self.write_seconds, 1e-6)
+        return {
+            "chunks": self.chunks,
+            "bytes": self.bytes,
+            "write_seconds": self.write_seconds,
+            "chunks_per_second": self.chunks / seconds,
+            "bytes_per_second": self.bytes / seconds,
+        }
@@ -1,6 +1,7 @@
 import base64
 import errno
 import functools
+import hashlib
 import json
 import multiprocessing
 import os
@@ -752,6 +753,14 @@ def decode_filename(encoded_filename):
     return urllib.parse.unquote(encoded_filename)
 
 
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
 async def save_content_to_local_disk(save_path: str, content):
     save_path = Path(save_path)
     try:
@@ -6,10 +6,12 @@ import requests
 import aiohttp
 from uuid import uuid4
 import redis
+import redis.asyncio
 from datetime import datetime
 from typing import List, Dict, Optional
 from langchain_core.prompts import PromptTemplate
-from comps import MegaServiceEndpoint, MicroService, ServiceOrchestrator, ServiceRoleType, ServiceType
+from comps import CustomLogger, MegaServiceEndpoint, MicroService, ServiceOrchestrator, ServiceRoleType, ServiceType
+from comps.core.answer_cache import SemanticAnswerCache
 from comps.core.utils import handle_message
 from comps.proto.api_protocol import (
     ChatCompletionRequest,
@@ -26,6 +28,8 @@ from fastapi import Request, HTTPException, File, UploadFile
 from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
 from mongo_client import mongo_client
 
+logger = CustomLogger("chatqna")
+
 SEMANTIC_SCHOLAR_SEARCH_URL = "https://api.semanticscholar.org/graph/v1/paper/search"
 SEMANTIC_SCHOLAR_REFERENCES_URL = "https://api.semanticscholar.org/graph/v1/paper/{paper_id}/references"
 ARXIV_SEARCH_URL = "http://export.arxiv.org/api/query"
@@ -52,6 +56,15 @@ LLM_SERVER_PORT = int(os.getenv("LLM_SERVER_PORT", 80))
 LLM_MODEL = os.getenv("LLM_MODEL_ID", "meta-llama/Meta-Llama-3.1-8B-Instruct")
 REDIS_URL = os.getenv("REDIS_URL")
 
+# Semantic answer cache of /v1/chatqna, needs REDIS_URL. ANSWER_CACHE_SIZE=0 disables it
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 1000))
+# Minimum cosine similarity between two questions for the cached answer of one to serve the other,
+# 1 only serves the answer of the same question, see the README before lowering it
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", 1.0))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", 3600))
+# Corpus version bumped by dataprep on every ingest and delete, invalidating the cached answers
+CORPUS_VERSION_KEY = os.getenv("CORPUS_VERSION_KEY", "corpus:version")
+
 # Add Whisper service constants
 WHISPER_SERVICE_HOST_IP = os.getenv("WHISPER_SERVICE_HOST_IP", "0.0.0.0")
 WHISPER_SERVICE_PORT = int(os.getenv("WHISPER_SERVICE_PORT", 8765))
@@ -207,7 +220,7 @@ def align_outputs(self, data, cur_node, inputs, runtime_graph, llm_parameters_di
 
     return next_data
 
-def align_generator(self, gen, **kwargs):
+async def align_generator(self, gen, **kwargs):
     buffer = ""
     request_id = kwargs.get("request_id", str(uuid4()))
     
@@ -227,8 +240,11 @@ def align_generator(self, gen, **kwargs):
     }
     
     full_response = ""
+    # only an answer streamed to its end without a malformed chunk is cached
+    finish_reason = None
+    malformed = False
     
-    for line in gen:
+    async for line in gen:
         line = line.decode("utf-8")
         start = line.find("{")
         end = line.rfind("}") + 1
@@ -254,6 +270,7 @@ def align_generator(self, gen, **kwargs):
                     yield buffer
                     buffer = ""
             
+            finish_reason = json_data["choices"][0]["finish_reason"] or finish_reason
             if json_data["choices"][0]["finish_reason"] == "stop":
                 e2e_latency = time.perf_counter() - e2e_start_time
                 throughput = token_count / max(e2e_latency - ttft, 0.001)
@@ -281,8 +298,14 @@ def align_generator(self, gen, **kwargs):
             
             cleaned_json_str = json_str.strip()
             if cleaned_json_str:
+                malformed = True
                 yield cleaned_json_str
     
+    # hand the complete answer to the semantic answer cache
+    on_answer = kwargs.get("on_answer")
+    if on_answer and full_response and finish_reason and not malformed:
+        on_answer(full_response)
+
     if not self.__class__._metrics_registry[request_id]["completed"]:
         e2e_latency = time.perf_counter() - e2e_start_time
         throughput = token_count / max(e2e_latency - ttft, 0.001)
@@ -465,6 +488,17 @@ If you don't know the answer to a question, please don't share false information
         return template.format(context=context_str, question=question)
 
 
+def query_vector(response) -> Optional[List[float]]:
+    """The question embedding of a TEI /embed response (one embedding per input) or an OpenAI style one."""
+    if isinstance(response, dict) and response.get("data"):
+        response = [item.get("embedding") for item in response["data"] if isinstance(item, dict)]
+    if isinstance(response, list) and response and isinstance(response[0], list):
+        response = response[0]
+    if isinstance(response, list) and response and all(isinstance(value, (int, float)) for value in response):
+        return response
+    return None
+
+
 class ChatQnAService:
     def __init__(self, host="0.0.0.0", port=8000):
         self.host = host
@@ -476,6 +510,16 @@ class ChatQnAService:
         self.megaservice = ServiceOrchestrator()
         self.endpoint = str(MegaServiceEndpoint.CHAT_QNA)
         self.last_result_dict = {}
+        self.answer_cache = None
+        self.answer_cache_warned = False
+        if REDIS_URL and ANSWER_CACHE_SIZE > 0:
+            self.answer_cache = SemanticAnswerCache(
+                redis.asyncio.from_url(REDIS_URL),
+                threshold=ANSWER_CACHE_THRESHOLD,
+                max_entries=ANSWER_CACHE_SIZE,
+                ttl=ANSWER_CACHE_TTL,
+                version_key=CORPUS_VERSION_KEY,
+            )
 
     def add_remote_service(self):
 
@@ -608,6 +652,61 @@ class ChatQnAService:
         self.megaservice.flow_to(rerank, llm)
         # self.megaservice.flow_to(llm, guardrail_out)
 
+    async def lookup_answer(self, prompt: str, settings: str):
+        """Embed the question and look for a cached answer.
+
+        Returns the cached entry or None, and the state to cache the answer of
+        the pipeline with, None when the cache cannot be used.
+        """
+        try:
+            response = await self.megaservice.embed_query(prompt)
+            embedding = query_vector(response)
+            if embedding is None:
+                if not self.answer_cache_warned:
+                    logger.warning(f"[ answer cache ] disabled, unexpected embedding response: {str(response)[:200]}")
+                    self.answer_cache_warned = True
+                return None, None
+            version = await self.answer_cache.corpus_version()
+            entry = await self.answer_cache.lookup(embedding, settings, prompt)
+        except Exception as e:
+            logger.error(f"[ answer cache ] unavailable: {e}")
+            return None, None
+        return entry, (embedding, settings, prompt, version)
+
+    def cache_answer(self, cache_state, answer: str, sources: List[Dict]):
+        chunk_ids = [src.get("id") or (src.get("metadata") or {}).get("id") for src in sources]
+        self.answer_cache.store(*cache_state, [chunk_id for chunk_id in chunk_ids if chunk_id], answer, sources)
+
+    def cached_answer_response(self, entry, stream: bool, start: float):
+        latency = time.perf_counter() - start
+        metrics = {
+            "ttft": latency,
+            "e2e_latency": latency,
+            "output_tokens": len(entry["answer"].split()),
+            "throughput": 0.0,
+        }
+        if stream:
+            # same chunks as align_generator: the answer text, then the metrics
+            def generate():
+                yield entry["answer"]
+                yield f"__METRICS__{json.dumps({'metrics': metrics})}__METRICS__"
+                yield ""
+
+            return StreamingResponse(generate(), media_type="text/event-stream")
+
+        completion_response = ChatCompletionResponse(
+            model="chatqna",
+            choices=[
+                ChatCompletionResponseChoice(
+                    index=0, message=ChatMessage(role="assistant", content=entry["answer"]), finish_reason="stop"
+                )
+            ],
+            usage=UsageInfo(),
+        )
+        response_dict = completion_response.dict()
+        response_dict["sources"] = entry["sources"]
+        return JSONResponse(content=response_dict)
+
     async def handle_request(self, request: Request):
         data = await request.json()
         stream_opt = data.get("stream", True)
@@ -645,6 +744,29 @@ class ChatQnAService:
         ttft_start_time = e2e_start_time
         
         try:
+            # answers depend on the question and on every parameter shaping the context and the generation
+            cache_state = None
+            on_answer = None
+            if self.answer_cache:
+                settings = json.dumps(
+                    {
+                        "retriever": retriever_parameters.dict(),
+                        "reranker": reranker_parameters.dict(),
+                        "chat_template": parameters.chat_template,
+                        "max_tokens": parameters.max_tokens,
+                    },
+                    sort_keys=True,
+                )
+                entry, cache_state = await self.lookup_answer(prompt, settings)
+                if entry is not None:
+                    self.last_result_dict = {}
+                    self.last_sources = entry["sources"]
+                    return self.cached_answer_response(entry, stream_opt, e2e_start_time)
+                if cache_state:
+                    # streamed answers are cached once complete, with the sources found below
+                    def on_answer(answer):
+                        self.cache_answer(cache_state, answer, sources)
+
             result_dict, runtime_graph = await self.megaservice.schedule(
                 initial_inputs={"text": prompt},
                 llm_parameters=parameters,
@@ -652,6 +774,7 @@ class ChatQnAService:
                 reranker_parameters=reranker_parameters,
                 ttft_start_time=ttft_start_time,
                 request_id=request_id,
+                on_answer=on_answer,
             )
             
             self.last_result_dict = result_dict
@@ -692,6 +815,8 @@ class ChatQnAService:
                 print(f"Error accessing last node response: {e}")
                 
             print(f"DEBUG: Using {len(sources)} pre-extracted sources for response")
+            if cache_state and response != "No response generated":
+                self.cache_answer(cache_state, response, sources)
                 
             choices = []
             usage = UsageInfo()
@@ -752,6 +877,14 @@ class ChatQnAService:
             traceback.print_exc()
             raise HTTPException(status_code=500, detail=str(e))
 
+    def serve(self):
+        """Run the service, with the HTTP session of the orchestrator open for its whole lifetime."""
+        self.service.event_loop.run_until_complete(self.megaservice.open_session())
+        try:
+            self.service.start()
+        finally:
+            self.service.event_loop.run_until_complete(self.megaservice.close())
+
     def start(self):
         self.service = MicroService(
             self.__class__.__name__,
@@ -765,7 +898,7 @@ class ChatQnAService:
 
         self.service.add_route(self.endpoint, self.handle_request, methods=["POST"])
 
-        self.service.start()
+        self.serve()
 
 
 class ConversationRAGService(ChatQnAService):
@@ -1330,7 +1463,7 @@ class ConversationRAGService(ChatQnAService):
         # self.service.add_route("/api/circulars", handle_circular_get, methods=["GET"])
         self.service.add_route("/api/transcribe", self.handle_transcribe, methods=["POST"])
         self.service.add_route("/api/whisper_healthcheck", self.handle_whisper_healthcheck, methods=["GET"])
-        self.service.start()
+        self.serve()
 
 if __name__ == "__main__":
     conversation_service = ConversationRAGService(port=int(os.getenv("MEGA_SERVICE_PORT", 9000)))
@@ -115,6 +115,10 @@ class RetrievalRequest(BaseModel):
     fetch_k: int = 20
     lambda_mult: float = 0.5
     score_threshold: float = 0.2
+    # HNSW candidate list size of this search, the index default when not set
+    ef_runtime: Optional[int] = None
+    # metadata filters applied before the search, e.g. {"file_name": "paper.pdf", "page": {"lte": 10}}
+    constraints: Optional[Union[Dict[str, Any], List[Dict[str, Any]]]] = None
 
     # define
     request_type: Literal["retrieval"] = "retrieval"
@@ -129,6 +133,24 @@ class RetrievalResponse(BaseModel):
     retrieved_docs: List[RetrievalResponseData]
 
 
+class RetrievalBatchRequest(BaseModel):
+    # either full requests, or bare query embeddings searched with the settings below
+    requests: Optional[List[RetrievalRequest]] = None
+    embeddings: Optional[List[List[float]]] = None
+    search_type: str = "similarity"
+    k: int = 4
+    distance_threshold: Optional[float] = None
+    constraints: Optional[Union[Dict[str, Any], List[Dict[str, Any]]]] = None
+
+    # define
+    request_type: Literal["retrieval_batch"] = "retrieval_batch"
+
+
+class RetrievalBatchResponse(BaseModel):
+    # in the order of the requests
+    results: List[RetrievalResponse]
+
+
 class RerankingRequest(BaseModel):
     input: str
     retrieved_docs: Union[List[RetrievalResponseData], List[Dict[str, Any]], List[str]]
@@ -0,0 +1,102 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Measure the recall and memory of quantized vectors against exact float32 search.
+
+Compares FLOAT16 vectors (INDEX_DATATYPE=FLOAT16) and the int8 local store
+(LOCAL_STORE_QUANTIZATION=int8) with and without rescoring, on a local store
+written by dataprep or on synthetic clustered vectors. Rescoring x1 is the
+recall of the int8 scan alone, and int8 scaled by 127 without calibrated
+ranges is shown for comparison:
+
+    python benchmark_recall.py --local-store ./local_store --queries 200 --k 4
+    python benchmark_recall.py --vectors 100000 --dims 768
+"""
+
+import argparse
+import json
+import os
+import tempfile
+
+import numpy as np
+from local_store import DELETED_FILE, RECORDS_FILE, VECTORS_FILE, LocalVectorStore
+
+
+def synthetic_store(path: str, count: int, dims: int, rng) -> LocalVectorStore:
+    # embeddings of real corpora are clustered by topic, uniform random vectors would be too easy to separate
+    centers = rng.standard_normal((max(count // 100, 1), dims)).astype(np.float32)
+    store = LocalVectorStore(path)
+    for start in range(0, count, 10000):
+        size = min(10000, count - start)
+        vectors = centers[rng.integers(len(centers), size=size)] + 0.5 * rng.standard_normal((size, dims))
+        ids = [str(i) for i in range(start, start + size)]
+        store.append(ids, [""] * size, vectors.astype(np.float32), [{} for _ in ids])
+    return store
+
+
+def recall(found, expected) -> float:
+    return len(set(found) & set(expected)) / max(len(expected), 1)
+
+
+def load_ids(path: str):
+    """Chunk id of every row, and a mask of the deleted rows."""
+    with open(os.path.join(path, RECORDS_FILE), "rb") as f:
+        ids = [json.loads(line)["id"] for line in f]
+    deleted = set()
+    if os.path.exists(os.path.join(path, DELETED_FILE)):
+        with open(os.path.join(path, DELETED_FILE)) as f:
+            deleted = {line.strip() for line in f}
+    return ids, np.array([chunk_id in deleted for chunk_id in ids])
+
+
+def main(args):
+    rng = np.random.default_rng(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.local_store or tmp
+        if not args.local_store:
+            synthetic_store(path, args.vectors, args.dims, rng)
+        exact = LocalVectorStore(path)
+        quantized = {rescore: LocalVectorStore(path, quantization="int8", rescore=rescore) for rescore in args.rescore}
+        dims = os.path.getsize(os.path.join(path, VECTORS_FILE)) // 4 // len(exact)
+        vectors = np.memmap(os.path.join(path, VECTORS_FILE), dtype=np.float32, mode="r", shape=(len(exact), dims))
+        half = vectors.astype(np.float16).astype(np.float32)
+        unscaled = np.round(vectors * 127).astype(np.int8).astype(np.float32)
+        ids, deleted = load_ids(path)
+
+        # queries close to stored chunks, like questions about the corpus
+        rows = rng.integers(len(exact), size=args.queries)
+        queries = vectors[rows] + 0.3 * rng.standard_normal((args.queries, dims)).astype(np.float32) / np.sqrt(dims)
+
+        results = {"FLOAT16": [], "int8 unscaled": []}
+        results.update({f"int8 rescore x{rescore}": [] for rescore in args.rescore})
+        for query in queries:
+            expected = [doc.metadata["id"] for doc in exact.search(query, args.k)]
+            scores = np.where(deleted, -np.inf, half @ query)
+            top = np.argpartition(-scores, args.k - 1)[: args.k]
+            results["FLOAT16"].append(recall([ids[row] for row in top], expected))
+            scores = np.where(deleted, -np.inf, unscaled @ query)
+            top = np.argpartition(-scores, args.k - 1)[: args.k]
+            results["int8 unscaled"].append(recall([ids[row] for row in top], expected))
+            for rescore, store in quantized.items():
+                found = [doc.metadata["id"] for doc in store.search(query, args.k)]
+                results[f"int8 rescore x{rescore}"].append(recall(found, expected))
+
+        print(f"{len(exact)} vectors of {dims} dims, {args.queries} queries, recall@{args.k} against FLOAT32")
+        print(f"{'FLOAT32':>18}: recall 1.0000  {dims * 4:6d} bytes/vector")
+        print(f"{'FLOAT16':>18}: recall {np.mean(results['FLOAT16']):.4f}  {dims * 2:6d} bytes/vector")
+        print(f"{'int8 unscaled':>18}: recall {np.mean(results['int8 unscaled']):.4f}  {dims:6d} bytes/vector resident")
+        for rescore in args.rescore:
+            name = f"int8 rescore x{rescore}"
+            print(f"{name:>18}: recall {np.mean(results[name]):.4f}  {dims:6d} bytes/vector resident")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--local-store", help="store written by dataprep, synthetic vectors are used when not set")
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--dims", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--rescore", type=int, nargs="+", default=[1, 4], help="rescoring factors of the int8 search")
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
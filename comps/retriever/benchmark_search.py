@@ -0,0 +1,75 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Compare the latency of the langchain and native similarity search engines.
+
+Runs the same random queries through both engines against the live index:
+
+    python benchmark_search.py --queries 500 --k 4 --concurrency 8
+"""
+
+import argparse
+import asyncio
+import time
+
+import numpy as np
+from langchain_community.embeddings import FakeEmbeddings
+from langchain_community.vectorstores import Redis
+from native_search import NativeSearchEngine
+from redis_config import INDEX_NAME, INDEX_SCHEMA, REDIS_URL, VECTOR_INDEX_OVERRIDES
+from redis_pool import get_async_client
+
+from comps.core.redis_schema import IndexSchema
+
+
+async def run(search, queries, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def timed(query):
+        async with semaphore:
+            start = time.perf_counter()
+            await search(query)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(query) for query in queries))
+    return np.array(latencies), time.perf_counter() - start
+
+
+def report(name: str, latencies, elapsed: float):
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    print(
+        f"{name:>10}: {len(latencies) / elapsed:8.1f} queries/s  "
+        f"p50 {p50:7.2f} ms  p95 {p95:7.2f} ms  p99 {p99:7.2f} ms"
+    )
+
+
+async def main(args):
+    schema = IndexSchema.from_yaml(INDEX_SCHEMA, VECTOR_INDEX_OVERRIDES)
+    dims = schema.vector["dims"]
+    rng = np.random.default_rng(args.seed)
+    queries = rng.standard_normal((args.queries, dims)).astype(np.float32).tolist()
+
+    vector_db = Redis(
+        embedding=FakeEmbeddings(size=dims), index_name=INDEX_NAME, index_schema=INDEX_SCHEMA, redis_url=REDIS_URL
+    )
+    engine = NativeSearchEngine(get_async_client(), schema, INDEX_NAME)
+    engines = {
+        "langchain": lambda query: vector_db.asimilarity_search_by_vector(embedding=query, k=args.k),
+        "native": lambda query: engine.search(query, k=args.k),
+    }
+
+    for name, search in engines.items():
+        # warm up connections and caches
+        await run(search, queries[: args.concurrency], args.concurrency)
+        report(name, *await run(search, queries, args.concurrency))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
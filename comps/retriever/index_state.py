@@ -0,0 +1,47 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import time
+
+from redis.exceptions import ResponseError
+from redis_config import INDEX_STATE_TTL
+
+from comps import CustomLogger
+
+logger = CustomLogger("index_state")
+logflag = os.getenv("LOGFLAG", False)
+
+
+class IndexStateTracker:
+    """Number of documents of a search index, read from FT.INFO at most every `ttl` seconds.
+
+    Lets the retriever check whether the index holds data in O(1) instead of
+    scanning the keyspace on every query. `client` is an async Redis client.
+    """
+
+    def __init__(self, client, index_name: str, ttl: float = INDEX_STATE_TTL):
+        self.client = client
+        self.index_name = index_name
+        self.ttl = ttl
+        self._num_docs = 0
+        self._expires_at = 0.0
+
+    async def num_docs(self) -> int:
+        now = time.monotonic()
+        if now >= self._expires_at:
+            try:
+                self._num_docs = int((await self.client.ft(self.index_name).info())["num_docs"])
+            except ResponseError:
+                # the index is created on the first ingest
+                self._num_docs = 0
+            self._expires_at = now + self.ttl
+            if logflag:
+                logger.info(f"[ index state ] {self.index_name} holds {self._num_docs} documents")
+        return self._num_docs
+
+    async def is_empty(self) -> bool:
+        return await self.num_docs() == 0
+
+    def invalidate(self):
+        self._expires_at = 0.0
@@ -0,0 +1,233 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+
+from comps import CustomLogger
+
+logger = CustomLogger("local_store")
+logflag = os.getenv("LOGFLAG", False)
+
+VECTORS_FILE = "vectors.f32"
+QUANTIZED_FILE = "vectors.i8"
+# per-dimension range mapped to the int8 levels of QUANTIZED_FILE
+QUANTIZED_RANGE_FILE = "vectors.i8.range"
+OFFSETS_FILE = "offsets.u64"
+RECORDS_FILE = "chunks.jsonl"
+DELETED_FILE = "deleted.txt"
+GENERATION_FILE = "generation"
+
+# rows scored at a time on the int8 matrix, bounds the float32 copy made per query
+_SCORE_BLOCK = 65536
+
+
+class LocalVectorStore:
+    """Append-only chunk store on local disk, searched without Redis.
+
+    Vectors are normalized and appended as raw float32 rows to `vectors.f32`,
+    the content and metadata of every chunk as one JSON line of `chunks.jsonl`,
+    and the byte offset of that line to `offsets.u64`. Readers memory-map the
+    vector and offset files, so opening the store reads nothing up front and
+    worker processes share the pages through the OS page cache. The offsets
+    file is written last and its length is the number of visible chunks, so a
+    reader never sees a half-written chunk. Deleted chunk ids are appended to
+    `deleted.txt` and skipped at search time. `clear()` increments the counter
+    in `generation`, readers then drop their mappings of the removed files
+    even when the store is refilled with as many chunks.
+
+    Every vector is also stored scalar-quantized to int8 in `vectors.i8`, each
+    dimension scaled to the max-abs range of the first appended chunks saved in
+    `vectors.i8.range` and clipped to it: the components of normalized
+    embeddings are far smaller than 1 and would otherwise use a few levels
+    only. With `quantization="int8"` searches scan that 4x smaller matrix, then
+    rescore the best `rescore` x k candidates with their float32 vectors, so
+    only the int8 matrix needs to stay resident in memory.
+
+    Similarity is cosine, reported as a distance like the Redis index.
+    """
+
+    def __init__(self, path: str, dims: Optional[int] = None, quantization: Optional[str] = None, rescore: int = 4):
+        if quantization not in (None, "none", "int8"):
+            raise ValueError(f"Unsupported quantization {quantization}, expected int8 or none")
+        self.path = path
+        self.dims = dims
+        self._configured_dims = dims
+        self.quantized = quantization == "int8"
+        self.rescore = rescore
+        os.makedirs(path, exist_ok=True)
+        self._quantized = None
+        self._quantized_range = None
+        self._vectors = None
+        self._offsets = None
+        self._deleted = set()
+        self._deleted_size = 0
+        self._generation = self._read_generation()
+        self._lock = threading.Lock()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def __len__(self) -> int:
+        return os.path.getsize(self._file(OFFSETS_FILE)) // 8 if os.path.exists(self._file(OFFSETS_FILE)) else 0
+
+    def append(self, ids: List[str], texts: List[str], vectors, metadatas: List[Dict]):
+        """Append chunks, `vectors` is a sequence of vectors of the same dimension."""
+        if not ids:
+            return
+        block = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+        if self.dims is None:
+            self.dims = block.shape[1]
+        if block.shape[1] != self.dims:
+            raise ValueError(f"Vector dimension {block.shape[1]} does not match the store dimension {self.dims}")
+        norms = np.linalg.norm(block, axis=1, keepdims=True)
+        block = block / np.where(norms == 0, 1, norms)
+
+        with self._lock:
+            with open(self._file(RECORDS_FILE), "ab") as records:
+                offset = records.tell()
+                offsets = []
+                for chunk_id, text, metadata in zip(ids, texts, metadatas):
+                    line = json.dumps({"id": chunk_id, "content": text, "metadata": metadata}).encode() + b"\n"
+                    records.write(line)
+                    offsets.append(offset)
+                    offset += len(line)
+            with open(self._file(VECTORS_FILE), "ab") as f:
+                f.write(block.tobytes())
+            with open(self._file(QUANTIZED_FILE), "ab") as f:
+                scale = 127 / self._calibrate(block)
+                f.write(np.clip(np.round(block * scale), -127, 127).astype(np.int8).tobytes())
+            with open(self._file(OFFSETS_FILE), "ab") as f:
+                f.write(np.asarray(offsets, dtype=np.uint64).tobytes())
+        if logflag:
+            logger.info(f"[ local store ] appended {len(ids)} chunks to {self.path}")
+
+    def _calibrate(self, block) -> np.ndarray:
+        """Per-dimension range of the int8 vectors, computed from `block` when the store has none yet."""
+        range_file = self._file(QUANTIZED_RANGE_FILE)
+        if os.path.exists(range_file):
+            return np.fromfile(range_file, dtype=np.float32)
+        if os.path.exists(self._file(QUANTIZED_FILE)) and os.path.getsize(self._file(QUANTIZED_FILE)):
+            # vectors quantized before ranges were calibrated map [-1, 1]
+            ranges = np.ones(block.shape[1], dtype=np.float32)
+        else:
+            # at least 4 standard deviations of a random unit vector component, a few first chunks are no sample
+            ranges = np.maximum(np.abs(block).max(axis=0), 4 / np.sqrt(block.shape[1])).astype(np.float32)
+        ranges.tofile(range_file)
+        return ranges
+
+    def delete(self, ids: List[str]):
+        with self._lock, open(self._file(DELETED_FILE), "a") as f:
+            f.writelines(f"{chunk_id}\n" for chunk_id in ids)
+
+    def _read_generation(self) -> int:
+        try:
+            with open(self._file(GENERATION_FILE)) as f:
+                return int(f.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def clear(self):
+        with self._lock:
+            generation = self._read_generation() + 1
+            for name in (OFFSETS_FILE, VECTORS_FILE, QUANTIZED_FILE, QUANTIZED_RANGE_FILE, RECORDS_FILE, DELETED_FILE):
+                if os.path.exists(self._file(name)):
+                    os.remove(self._file(name))
+            # replaced in one rename, readers never see a partial counter
+            with open(self._file(GENERATION_FILE + ".tmp"), "w") as f:
+                f.write(str(generation))
+            os.replace(self._file(GENERATION_FILE + ".tmp"), self._file(GENERATION_FILE))
+            self.dims = self._configured_dims
+
+    def _refresh(self):
+        """Map the chunks appended since the last search, and reload the deleted ids if they changed."""
+        generation = self._read_generation()
+        if generation != self._generation:
+            # the files were removed since they were mapped, start over from the new ones
+            self._offsets = self._vectors = self._quantized = self._quantized_range = None
+            self._deleted, self._deleted_size = set(), 0
+            self.dims = self._configured_dims
+            self._generation = generation
+        count = len(self)
+        if self._offsets is None or len(self._offsets) != count:
+            if count:
+                self._offsets = np.memmap(self._file(OFFSETS_FILE), dtype=np.uint64, mode="r", shape=(count,))
+                if self.dims is None:
+                    self.dims = os.path.getsize(self._file(VECTORS_FILE)) // 4 // count
+                self._vectors = np.memmap(
+                    self._file(VECTORS_FILE), dtype=np.float32, mode="r", shape=(count, self.dims)
+                )
+                self._quantized = None
+                quantized_file = self._file(QUANTIZED_FILE)
+                if self.quantized and os.path.exists(quantized_file):
+                    if os.path.getsize(quantized_file) >= count * self.dims:
+                        self._quantized = np.memmap(quantized_file, dtype=np.int8, mode="r", shape=(count, self.dims))
+                        range_file = self._file(QUANTIZED_RANGE_FILE)
+                        if os.path.exists(range_file):
+                            self._quantized_range = np.fromfile(range_file, dtype=np.float32)
+                        else:
+                            self._quantized_range = np.ones(self.dims, dtype=np.float32)
+                    else:
+                        logger.info(f"[ local store ] {quantized_file} is incomplete, searching float32 vectors")
+            else:
+                self._offsets = np.zeros(0, dtype=np.uint64)
+        deleted_file = self._file(DELETED_FILE)
+        size = os.path.getsize(deleted_file) if os.path.exists(deleted_file) else 0
+        if size != self._deleted_size:
+            self._deleted = set()
+            if size:
+                with open(deleted_file) as f:
+                    self._deleted = {line.strip() for line in f if line.strip()}
+            self._deleted_size = size
+
+    def search(
+        self, embedding: List[float], k: int = 4, distance_threshold: Optional[float] = None
+    ) -> List[Document]:
+        with self._lock:
+            self._refresh()
+            offsets, vectors, quantized, deleted = self._offsets, self._vectors, self._quantized, self._deleted
+            quantized_range = self._quantized_range
+        if not len(offsets) or k <= 0:
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        if len(query) != self.dims:
+            raise ValueError(f"Query dimension {len(query)} does not match the store dimension {self.dims}")
+        query = query / (np.linalg.norm(query) or 1)
+
+        # fetch enough candidates to still have k once deleted chunks are skipped
+        fetch = min(k + len(deleted), len(offsets))
+        if quantized is not None:
+            # int8 levels back to the calibrated range, folded into the query
+            scaled = query * quantized_range / 127
+            blocks = range(0, len(quantized), _SCORE_BLOCK)
+            approx = np.concatenate([quantized[i : i + _SCORE_BLOCK].astype(np.float32) @ scaled for i in blocks])
+            candidates = min(fetch * self.rescore, len(approx))
+            rows = np.sort(np.argpartition(-approx, candidates - 1)[:candidates])
+            scores = vectors[rows] @ query
+        else:
+            rows = np.arange(len(offsets))
+            scores = vectors @ query
+        top = np.argpartition(-scores, fetch - 1)[:fetch]
+        top = top[np.argsort(-scores[top])]
+
+        docs = []
+        with open(self._file(RECORDS_FILE), "rb") as records:
+            for i in top:
+                row = rows[i]
+                distance = 1.0 - float(scores[i])
+                if distance_threshold is not None and distance > distance_threshold:
+                    break
+                records.seek(int(offsets[row]))
+                record = json.loads(records.readline())
+                if record["id"] in deleted:
+                    continue
+                metadata = {"id": record["id"], **record["metadata"], "vector_distance": distance}
+                docs.append(Document(page_content=record["content"], metadata=metadata))
+                if len(docs) == k:
+                    break
+        return docs
@@ -0,0 +1,262 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import os
+import re
+import urllib.parse
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+from langchain_core.documents import Document
+
+from comps import CustomLogger
+from comps.core.redis_schema import IndexSchema
+
+logger = CustomLogger("native_search")
+logflag = os.getenv("LOGFLAG", False)
+
+DISTANCE_FIELD = "vector_distance"
+HYBRID_SCORE_FIELD = "hybrid_score"
+
+# terms of a full-text query, RediSearch splits the indexed text on punctuation too
+_TERM_RE = re.compile(r"\w+")
+# clauses of a full-text query, terms and exact phrases
+MAX_TEXT_TERMS = 32
+
+# characters of a tag value escaped in a TAG filter
+_TAG_SPECIAL_RE = re.compile(r"([^\w])")
+_RANGE_OPERATORS = {"gt", "gte", "lt", "lte"}
+# tag field holding the file name percent-encoded by dataprep (utils.encode_filename)
+FILE_NAME_FIELD = "file_name"
+
+
+def _file_name_values(value) -> List[str]:
+    """Stored forms of the file names of a constraint.
+
+    list_files and get_file show the decoded names, the retrieved chunks the
+    encoded ones: both are matched.
+    """
+    values = value if isinstance(value, (list, tuple, set)) else [value]
+    matched = []
+    for v in values:
+        if isinstance(v, str):
+            matched += [urllib.parse.quote(v, safe=""), v]
+        else:
+            matched.append(v)
+    return list(dict.fromkeys(matched))
+
+
+def _tag_filter(field: str, value) -> str:
+    values = value if isinstance(value, (list, tuple, set)) else [value]
+    if not values:
+        raise ValueError(f"Constraint on {field} has no value")
+    if any(isinstance(v, (dict, list)) for v in values):
+        raise ValueError(f"Constraint on {field} expects a value or a list of values")
+    escaped = [_TAG_SPECIAL_RE.sub(r"\\\1", str(v)) for v in values]
+    return f"@{field}:{{{' | '.join(escaped)}}}"
+
+
+def _number(field: str, value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Constraint on {field} expects numbers, got {value!r}")
+
+
+def _numeric_filter(field: str, value) -> str:
+    if isinstance(value, dict):
+        unknown = set(value) - _RANGE_OPERATORS
+        if unknown:
+            raise ValueError(f"Unsupported operators {sorted(unknown)} on {field}, expected gt, gte, lt or lte")
+        low, high = "-inf", "+inf"
+        if "gte" in value:
+            low = f"{_number(field, value['gte'])}"
+        if "gt" in value:
+            low = f"({_number(field, value['gt'])}"
+        if "lte" in value:
+            high = f"{_number(field, value['lte'])}"
+        if "lt" in value:
+            high = f"({_number(field, value['lt'])}"
+        return f"@{field}:[{low} {high}]"
+    values = value if isinstance(value, (list, tuple, set)) else [value]
+    if not values:
+        raise ValueError(f"Constraint on {field} has no value")
+    numbers = [_number(field, v) for v in values]
+    ranges = [f"@{field}:[{v} {v}]" for v in numbers]
+    return ranges[0] if len(ranges) == 1 else f"({' | '.join(ranges)})"
+
+
+def constraints_to_filter(
+    schema: IndexSchema, constraints: Optional[Union[Dict[str, Any], List[Dict[str, Any]]]]
+) -> Optional[str]:
+    """Translate request constraints into a RediSearch pre-filter on the tag and numeric fields of `schema`.
+
+    A dict matches chunks satisfying all of its fields, a list of dicts chunks
+    matching any of them. A tag field takes a value or a list of accepted
+    values, a numeric field a number, a list of numbers or a range such as
+    {"gte": 2, "lt": 10}.
+    """
+    if not constraints:
+        return None
+    groups = [constraints] if isinstance(constraints, dict) else constraints
+    expressions = []
+    for group in groups:
+        filters = []
+        for field, value in group.items():
+            if field == FILE_NAME_FIELD and field in schema.tag_keys:
+                filters.append(_tag_filter(field, _file_name_values(value)))
+            elif field in schema.tag_keys:
+                filters.append(_tag_filter(field, value))
+            elif field in schema.numeric_keys:
+                filters.append(_numeric_filter(field, value))
+            else:
+                filterable = schema.tag_keys + schema.numeric_keys
+                raise ValueError(f"Cannot filter on {field}, filterable fields are {filterable}")
+        if filters:
+            expressions.append(" ".join(filters))
+    if not expressions:
+        return None
+    return expressions[0] if len(expressions) == 1 else " | ".join(f"({e})" for e in expressions)
+
+
+def reciprocal_rank_fusion(
+    ranked_lists: Sequence[List[Document]], weights: Sequence[float], k: int, rrf_k: int = 60
+) -> List[Document]:
+    """Merge ranked result lists, a chunk scores the sum of weight / (rrf_k + rank) over the lists it appears in.
+
+    The fused score is stored in `metadata["hybrid_score"]`. A chunk found by
+    several lists keeps the metadata of the first one, e.g. its vector distance.
+    """
+    scores, docs = {}, {}
+    for ranked, weight in zip(ranked_lists, weights):
+        for rank, doc in enumerate(ranked, start=1):
+            key = doc.metadata["id"]
+            scores[key] = scores.get(key, 0.0) + weight / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    fused = sorted(scores, key=scores.get, reverse=True)[:k]
+    for key in fused:
+        docs[key].metadata[HYBRID_SCORE_FIELD] = scores[key]
+    return [docs[key] for key in fused]
+
+
+class NativeSearchEngine:
+    """KNN search over the chunk hashes with a raw FT.SEARCH, without going through langchain.
+
+    Only the content, the requested metadata fields and the vector distance are
+    read back. Searches run on the async Redis client, so they never block the
+    event loop. Results are langchain Documents, like the langchain path, with
+    the chunk key in `metadata["id"]` and the distance in `metadata["vector_distance"]`.
+    """
+
+    def __init__(self, client, schema: IndexSchema, index_name: str, return_fields: Optional[List[str]] = None):
+        self.client = client
+        self.schema = schema
+        self.index_name = index_name
+        self.return_fields = return_fields if return_fields is not None else schema.metadata_keys
+
+    def build_query(self, k: int, filter_expression: Optional[str] = None, ef_runtime: Optional[int] = None) -> str:
+        """KNN query over the chunks matching `filter_expression`, a RediSearch query, or all of them."""
+        base = f"({filter_expression})" if filter_expression else "*"
+        ef = " EF_RUNTIME $ef_runtime" if ef_runtime else ""
+        return f"{base}=>[KNN {k} @{self.schema.vector_key} $vector{ef} AS {DISTANCE_FIELD}]"
+
+    def build_text_query(self, text: str, filter_expression: Optional[str] = None) -> Optional[str]:
+        """Full-text query matching chunks containing any term of `text`, None when it has no term.
+
+        A word made of several terms joined by punctuation ("GPT-4", "2.0") also
+        adds their exact phrase: RediSearch indexed it as adjacent tokens, so
+        chunks containing the whole word outrank those matching one part only.
+        """
+        clauses = []
+        for word in text.split():
+            terms = [term.lower() for term in _TERM_RE.findall(word)]
+            if len(terms) > 1:
+                clauses.append(f'"{" ".join(terms)}"')
+            clauses.extend(terms)
+        clauses = list(dict.fromkeys(clauses))[:MAX_TEXT_TERMS]
+        if not clauses:
+            return None
+        query = f"@{self.schema.content_key}:({'|'.join(clauses)})"
+        return f"({filter_expression}) {query}" if filter_expression else query
+
+    async def search(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter_expression: Optional[str] = None,
+        distance_threshold: Optional[float] = None,
+        return_fields: Optional[List[str]] = None,
+        ef_runtime: Optional[int] = None,
+    ) -> List[Document]:
+        """`ef_runtime` overrides the HNSW candidate list size of the index for this search."""
+        if ef_runtime and self.schema.algorithm != "HNSW":
+            raise ValueError(f"ef_runtime only applies to HNSW indexes, {self.index_name} uses {self.schema.algorithm}")
+        fields = [self.schema.content_key, *(return_fields if return_fields is not None else self.return_fields)]
+        fields.append(DISTANCE_FIELD)
+        params = ["vector", self.schema.vector_to_bytes(embedding)]
+        if ef_runtime:
+            params += ["ef_runtime", ef_runtime]
+        args = ["FT.SEARCH", self.index_name, self.build_query(k, filter_expression, ef_runtime)]
+        args += ["PARAMS", len(params), *params]
+        args += ["SORTBY", DISTANCE_FIELD, "ASC", "RETURN", len(fields), *fields]
+        args += ["LIMIT", 0, k, "DIALECT", 2]
+        response = await self.client.execute_command(*args)
+        return self.parse_response(response, distance_threshold)
+
+    async def text_search(
+        self,
+        text: str,
+        k: int = 4,
+        filter_expression: Optional[str] = None,
+        return_fields: Optional[List[str]] = None,
+    ) -> List[Document]:
+        """BM25 ranked full-text search of `text` over the chunk content."""
+        query = self.build_text_query(text, filter_expression)
+        if query is None:
+            return []
+        fields = [self.schema.content_key, *(return_fields if return_fields is not None else self.return_fields)]
+        args = ["FT.SEARCH", self.index_name, query, "SCORER", "BM25", "RETURN", len(fields), *fields]
+        args += ["LIMIT", 0, k, "DIALECT", 2]
+        response = await self.client.execute_command(*args)
+        return self.parse_response(response)
+
+    async def hybrid_search(
+        self,
+        embedding: List[float],
+        text: str,
+        k: int = 4,
+        fetch_k: int = 20,
+        filter_expression: Optional[str] = None,
+        return_fields: Optional[List[str]] = None,
+        ef_runtime: Optional[int] = None,
+        vector_weight: float = 1.0,
+        text_weight: float = 1.0,
+        rrf_k: int = 60,
+    ) -> List[Document]:
+        """Run the KNN and the full-text searches together, `fetch_k` results each, and fuse them to `k` with RRF."""
+        fetch_k = max(fetch_k, k)
+        vector_docs, text_docs = await asyncio.gather(
+            self.search(embedding, fetch_k, filter_expression, return_fields=return_fields, ef_runtime=ef_runtime),
+            self.text_search(text, fetch_k, filter_expression, return_fields),
+        )
+        if logflag:
+            logger.info(f"[ native search ] fusing {len(vector_docs)} vector and {len(text_docs)} text results")
+        return reciprocal_rank_fusion([vector_docs, text_docs], [vector_weight, text_weight], k, rrf_k)
+
+    def parse_response(self, response, distance_threshold: Optional[float] = None) -> List[Document]:
+        docs = []
+        for key, values in zip(response[1::2], response[2::2]):
+            metadata = {"id": key.decode() if isinstance(key, bytes) else key}
+            for field, value in zip(values[::2], values[1::2]):
+                field = field.decode() if isinstance(field, bytes) else field
+                metadata[field] = value.decode() if isinstance(value, bytes) else value
+            # only KNN results carry a distance
+            if DISTANCE_FIELD in metadata:
+                metadata[DISTANCE_FIELD] = float(metadata[DISTANCE_FIELD])
+                # KNN results are sorted by distance, a range search keeps the first ones within the threshold
+                if distance_threshold is not None and metadata[DISTANCE_FIELD] > distance_threshold:
+                    break
+            docs.append(Document(page_content=metadata.pop(self.schema.content_key, ""), metadata=metadata))
+        if logflag:
+            logger.info(f"[ native search ] {len(docs)} chunks found")
+        return docs
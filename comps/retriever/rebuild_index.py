@@ -0,0 +1,120 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Re-create the vector index with new vector parameters, without re-embedding.
+
+The index is dropped without its documents and created again over the same
+chunk hashes, Redis then re-indexes the stored vectors in the background:
+
+    python rebuild_index.py --algorithm HNSW --m 32 --ef-construction 400 --ef-runtime 20 --wait
+
+Parameters not given on the command line come from the schema file and the
+INDEX_ALGORITHM / INDEX_DATATYPE / HNSW_* environment variables, so pass the
+same values to the dataprep and retriever services afterwards. Searches return
+partial results until re-indexing completes.
+
+--datatype re-encodes the stored vectors in place while the index is dropped,
+e.g. to halve their memory with FLOAT16:
+
+    python rebuild_index.py --datatype FLOAT16 --wait
+"""
+
+import argparse
+import time
+
+import numpy as np
+import redis
+from redis_config import INDEX_NAME, INDEX_SCHEMA, REDIS_URL, VECTOR_INDEX_OVERRIDES
+
+from comps.core.redis_schema import VECTOR_DTYPES, IndexSchema, index_exists
+
+# chunk hashes re-encoded per pipeline round trip
+CONVERT_BATCH_SIZE = 1000
+
+
+def stored_dims(client, prefix: str, schema: IndexSchema) -> int:
+    """Dimension of the stored vectors, read from one chunk hash."""
+    for key in client.scan_iter(match=f"{prefix}:*", count=1000):
+        vector = client.hget(key, schema.vector_key)
+        if vector:
+            return len(vector) // np.dtype(schema.vector_dtype).itemsize
+    return schema.vector["dims"]
+
+
+def convert_vectors(client, prefix: str, vector_key: str, source, target) -> int:
+    """Re-encode the vector of every chunk hash from the `source` to the `target` numpy dtype."""
+    converted = 0
+    keys = client.scan_iter(match=f"{prefix}:*", count=CONVERT_BATCH_SIZE)
+    pipe = client.pipeline(transaction=False)
+    while True:
+        batch = [key for _, key in zip(range(CONVERT_BATCH_SIZE), keys)]
+        if not batch:
+            return converted
+        for key in batch:
+            pipe.hget(key, vector_key)
+        for key, vector in zip(batch, pipe.execute()):
+            if vector:
+                pipe.hset(key, vector_key, np.frombuffer(vector, dtype=source).astype(target).tobytes())
+                converted += 1
+        pipe.execute()
+        print(f"{converted} vectors converted")
+
+
+def wait_for_indexing(client, index_name: str, interval: float = 2.0):
+    while True:
+        info = client.ft(index_name).info()
+        done = float(info.get("percent_indexed", 1))
+        print(f"{index_name}: {done * 100:.1f}% indexed, {info['num_docs']} documents")
+        if done >= 1:
+            return
+        time.sleep(interval)
+
+
+def main(args):
+    # the vectors are stored with the configured datatype until converted
+    stored = IndexSchema.from_yaml(INDEX_SCHEMA, {**VECTOR_INDEX_OVERRIDES, "datatype": args.from_datatype})
+    source = stored.vector["datatype"]
+    overrides = dict(VECTOR_INDEX_OVERRIDES)
+    cli = {"algorithm": args.algorithm, "m": args.m, "ef_construction": args.ef_construction}
+    cli.update(ef_runtime=args.ef_runtime, datatype=args.datatype)
+    overrides.update({name: value for name, value in cli.items() if value is not None})
+    schema = IndexSchema.from_yaml(INDEX_SCHEMA, overrides)
+    target = schema.vector["datatype"]
+
+    client = redis.Redis.from_url(REDIS_URL)
+    prefix = f"doc:{args.index_name}"
+    dims = stored_dims(client, prefix, stored)
+    print(f"{args.index_name}: {schema.algorithm} {source} -> {target} {dims} dims over {prefix}:*")
+    for field in schema.get_fields(dims):
+        print(f"  {field.args}")
+    if args.dry_run:
+        return
+
+    if index_exists(client, args.index_name):
+        # keep the chunk hashes, only the index structure is rebuilt
+        client.ft(args.index_name).dropindex(delete_documents=False)
+    if source != target:
+        convert_vectors(client, prefix, schema.vector_key, VECTOR_DTYPES[source], VECTOR_DTYPES[target])
+    schema.create_index(client, args.index_name, prefix=prefix, dims=dims)
+    print(f"{args.index_name} re-created")
+    if args.wait:
+        wait_for_indexing(client, args.index_name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--index-name", default=INDEX_NAME)
+    parser.add_argument("--algorithm", choices=["FLAT", "HNSW"], type=str.upper)
+    parser.add_argument("--m", type=int)
+    parser.add_argument("--ef-construction", type=int)
+    parser.add_argument("--ef-runtime", type=int)
+    parser.add_argument("--datatype", choices=list(VECTOR_DTYPES), type=str.upper)
+    parser.add_argument(
+        "--from-datatype",
+        choices=list(VECTOR_DTYPES),
+        type=str.upper,
+        help="datatype the vectors are stored with, defaults to the configured one",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="print the new index definition and exit")
+    parser.add_argument("--wait", action="store_true", help="wait until all chunks are re-indexed")
+    main(parser.parse_args())
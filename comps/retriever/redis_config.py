@@ -3,6 +3,8 @@
 
 import os
 
+from comps.core.redis_schema import vector_index_overrides
+
 
 def get_boolean_env_var(var_name, default_value=False):
     """Retrieve the boolean value of an environment variable.
@@ -42,6 +44,11 @@ if DEBUG:
 # Embedding model
 EMBED_MODEL = os.getenv("EMBED_MODEL", "BAAI/bge-base-en-v1.5")
 
+# On-disk embedding cache of the query texts, set EMBED_CACHE_PATH to an empty string to disable it
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "./embedding_cache/embeddings.db")
+# Number of embeddings kept in the cache before evicting the least recently used ones
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", 200000))
+
 
 # Redis Connection Information
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
@@ -69,6 +76,38 @@ REDIS_URL = format_redis_conn_from_env()
 
 # Vector Index Configuration
 INDEX_NAME = os.getenv("INDEX_NAME", "rag-redis")
+KEY_INDEX_NAME = os.getenv("KEY_INDEX_NAME", "file-keys")
+
+# Reverse mapping from chunk id to its source file, written by dataprep at ingest time
+CHUNK_MAP_PREFIX = os.getenv("CHUNK_MAP_PREFIX", "chunk-file:")
+# Seconds a chunk id found in no file is remembered as such, so queries do not walk file-keys for it again
+CHUNK_MAP_MISS_TTL = int(os.getenv("CHUNK_MAP_MISS_TTL", 3600))
+
+# Size of the async Redis connection pool of the retriever, and seconds a request waits for a free connection
+REDIS_POOL_SIZE = int(os.getenv("REDIS_POOL_SIZE", 50))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", 5))
+
+# Engine running similarity searches: "langchain", "native" (raw FT.SEARCH KNN queries)
+# or "local" (memory-mapped store written by dataprep, no Redis needed)
+RETRIEVER_ENGINE = os.getenv("RETRIEVER_ENGINE", "langchain")
+LOCAL_STORE_PATH = os.getenv("LOCAL_STORE_PATH", "./local_store")
+# Search the int8 copy of the local store vectors ("int8" or "none"), rescoring the best
+# LOCAL_STORE_RESCORE x k candidates with their float32 vectors
+LOCAL_STORE_QUANTIZATION = os.getenv("LOCAL_STORE_QUANTIZATION", "none")
+LOCAL_STORE_RESCORE = int(os.getenv("LOCAL_STORE_RESCORE", 4))
+
+# Fusion of the hybrid search: rank constant of reciprocal rank fusion, and the weights of the
+# KNN and of the BM25 full-text result lists
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", 60))
+HYBRID_VECTOR_WEIGHT = float(os.getenv("HYBRID_VECTOR_WEIGHT", 1.0))
+HYBRID_TEXT_WEIGHT = float(os.getenv("HYBRID_TEXT_WEIGHT", 1.0))
+
+# Seconds the document count of the index is cached before asking Redis again
+INDEX_STATE_TTL = float(os.getenv("INDEX_STATE_TTL", 5))
+
+# Maximum number of queries of one /v1/retrieval/batch call, and how many of them are searched at the same time
+RETRIEVAL_BATCH_MAX_SIZE = int(os.getenv("RETRIEVAL_BATCH_MAX_SIZE", 1000))
+RETRIEVAL_BATCH_CONCURRENCY = int(os.getenv("RETRIEVAL_BATCH_CONCURRENCY", 16))
 
 
 current_file_path = os.path.abspath(__file__)
@@ -76,3 +115,6 @@ parent_dir = os.path.dirname(current_file_path)
 REDIS_SCHEMA = os.getenv("REDIS_SCHEMA", "redis_schema_multi.yml")
 schema_path = os.path.join(parent_dir, REDIS_SCHEMA)
 INDEX_SCHEMA = schema_path
+
+# INDEX_ALGORITHM, HNSW_* and INDEX_DATATYPE overrides of the vector field of the schema file
+VECTOR_INDEX_OVERRIDES = vector_index_overrides()
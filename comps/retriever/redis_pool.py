@@ -0,0 +1,50 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import redis.asyncio as aioredis
+from prometheus_client import Gauge
+from redis_config import REDIS_POOL_SIZE, REDIS_POOL_TIMEOUT, REDIS_URL
+
+
+class CountingConnectionPool(aioredis.BlockingConnectionPool):
+    """Blocking pool counting its own connections for the gauges.
+
+    redis-py keeps them in private attributes that change between releases,
+    only the public pool methods are overridden here.
+    """
+
+    def reset(self):
+        super().reset()
+        self.created_connections = 0
+        # connections handed out and not released yet, a failed checkout is released without being counted
+        self.checked_out = set()
+
+    def make_connection(self):
+        connection = super().make_connection()
+        self.created_connections += 1
+        return connection
+
+    async def get_connection(self, *args, **kwargs):
+        connection = await super().get_connection(*args, **kwargs)
+        self.checked_out.add(connection)
+        return connection
+
+    async def release(self, connection):
+        await super().release(connection)
+        self.checked_out.discard(connection)
+
+
+# Shared by every request of the retriever, requests wait up to
+# REDIS_POOL_TIMEOUT seconds for a free connection once REDIS_POOL_SIZE are in use
+async_redis_pool = CountingConnectionPool.from_url(REDIS_URL, max_connections=REDIS_POOL_SIZE, timeout=REDIS_POOL_TIMEOUT)
+
+pool_in_use = Gauge("retriever_redis_pool_in_use", "Redis connections of the retriever pool in use")
+pool_idle = Gauge("retriever_redis_pool_idle", "Open Redis connections of the retriever pool waiting for a request")
+pool_size = Gauge("retriever_redis_pool_size", "Maximum number of Redis connections of the retriever pool")
+pool_in_use.set_function(lambda: len(async_redis_pool.checked_out))
+pool_idle.set_function(lambda: async_redis_pool.created_connections - len(async_redis_pool.checked_out))
+pool_size.set(REDIS_POOL_SIZE)
+
+
+def get_async_client() -> aioredis.Redis:
+    return aioredis.Redis(connection_pool=async_redis_pool)
@@ -1,13 +1,39 @@
 # Copyright (C) 2024 Intel Corporation
 # SPDX-License-Identifier: Apache-2.0
 
+import asyncio
 import os
 import time
 import redis
-from typing import Union
+from typing import Dict, List, Optional, Union
 from langchain_huggingface import HuggingFaceEmbeddings, HuggingFaceEndpointEmbeddings
+from fastapi import HTTPException
+from index_state import IndexStateTracker
 from langchain_community.vectorstores import Redis
-from redis_config import EMBED_MODEL, INDEX_NAME, INDEX_SCHEMA, REDIS_URL
+from local_store import LocalVectorStore
+from native_search import NativeSearchEngine, constraints_to_filter
+from redis_config import (
+    CHUNK_MAP_MISS_TTL,
+    CHUNK_MAP_PREFIX,
+    EMBED_CACHE_MAX_ENTRIES,
+    EMBED_CACHE_PATH,
+    EMBED_MODEL,
+    HYBRID_RRF_K,
+    HYBRID_TEXT_WEIGHT,
+    HYBRID_VECTOR_WEIGHT,
+    INDEX_NAME,
+    INDEX_SCHEMA,
+    KEY_INDEX_NAME,
+    LOCAL_STORE_PATH,
+    LOCAL_STORE_QUANTIZATION,
+    LOCAL_STORE_RESCORE,
+    REDIS_URL,
+    RETRIEVAL_BATCH_CONCURRENCY,
+    RETRIEVAL_BATCH_MAX_SIZE,
+    RETRIEVER_ENGINE,
+    VECTOR_INDEX_OVERRIDES,
+)
+from redis_pool import get_async_client
 
 from comps import (
     CustomLogger,
@@ -22,29 +48,87 @@ from comps import (
     register_statistics,
     statistics_dict,
 )
+from comps.core.embedding_cache import cached_embeddings, tei_model_key
+from comps.core.redis_schema import IndexSchema, index_attributes
 from comps.proto.api_protocol import (
     ChatCompletionRequest,
     EmbeddingResponse,
+    RetrievalBatchRequest,
+    RetrievalBatchResponse,
     RetrievalRequest,
     RetrievalResponse,
     RetrievalResponseData,
 )
 # from comps.third_parties.bridgetower.src.bridgetower_embedding import BridgeTowerEmbedding
 REDIS_URL = os.getenv("REDIS_URL")
-redis_pool = redis.ConnectionPool.from_url(REDIS_URL)
-
-def get_file_name(chunk_id):
-    r = redis.Redis(connection_pool=redis_pool)
-    client = r.ft('file-keys')
-    
-    results = client.search("*")
-    
-    for doc in results.docs:
-        key_ids = doc.key_ids.split("#")
-        if chunk_id in key_ids:
-            return doc.file_name
-    
-    return None
+
+# chunk provenance fields stored as NUMERIC, see redis_schema_multi.yml
+NUMERIC_SOURCE_FIELDS = ("page", "chunk_index", "start_index", "end_index")
+
+
+def _cast_source_fields(source: Dict) -> Dict:
+    for field in NUMERIC_SOURCE_FIELDS:
+        if source.get(field) not in (None, ""):
+            source[field] = int(source[field])
+    return source
+
+
+def _decode_source(raw: Dict[bytes, bytes]) -> Optional[Dict]:
+    if not raw:
+        return None
+    return _cast_source_fields({k.decode(): v.decode() for k, v in raw.items()})
+
+
+async def _backfill_chunk_sources(r, chunk_ids: set, batch_size: int = 100) -> Dict[str, Dict]:
+    """Resolve chunks ingested before the chunk map existed by walking file-keys once, then backfill the map.
+
+    Chunks found in no file are mapped to an empty file name for
+    CHUNK_MAP_MISS_TTL seconds, so the next queries skip the walk.
+    """
+    found = {}
+    offset = 0
+    while chunk_ids - found.keys():
+        try:
+            response = await r.execute_command("FT.SEARCH", KEY_INDEX_NAME, "*", "LIMIT", offset, batch_size)
+        except redis.exceptions.ResponseError:
+            break
+        docs = response[1::2]
+        for fields in response[2::2]:
+            doc = dict(zip(fields[::2], fields[1::2]))
+            file_name = doc.get(b"file_name", b"").decode()
+            for key_id in doc.get(b"key_ids", b"").decode().split("#"):
+                if key_id in chunk_ids:
+                    found[key_id] = {"file_name": file_name}
+        offset += batch_size
+        if len(docs) < batch_size:
+            break
+
+    pipe = r.pipeline(transaction=False)
+    for chunk_id, source in found.items():
+        pipe.hset(CHUNK_MAP_PREFIX + chunk_id, mapping=source)
+    for chunk_id in chunk_ids - found.keys():
+        pipe.hset(CHUNK_MAP_PREFIX + chunk_id, mapping={"file_name": ""})
+        pipe.expire(CHUNK_MAP_PREFIX + chunk_id, CHUNK_MAP_MISS_TTL)
+    await pipe.execute()
+    return found
+
+
+async def get_chunk_sources(chunk_ids: List[str]) -> List[Optional[Dict]]:
+    """Resolve the source file of chunks ingested without provenance fields in one pipelined lookup."""
+    if not chunk_ids:
+        return []
+    r = get_async_client()
+    pipe = r.pipeline(transaction=False)
+    for chunk_id in chunk_ids:
+        pipe.hgetall(CHUNK_MAP_PREFIX + chunk_id)
+    sources = [_decode_source(raw) for raw in await pipe.execute()]
+
+    missing = {chunk_id for chunk_id, source in zip(chunk_ids, sources) if source is None}
+    if missing:
+        found = await _backfill_chunk_sources(r, missing)
+        sources = [source or found.get(chunk_id) for chunk_id, source in zip(chunk_ids, sources)]
+    # an empty file name records a chunk already looked up in vain
+    return [source if source and source.get("file_name") else None for source in sources]
 
 logger = CustomLogger("retriever_redis")
 logflag = os.getenv("LOGFLAG", False)
@@ -53,6 +137,152 @@ tei_embedding_endpoint = os.getenv("TEI_EMBEDDING_ENDPOINT")
 bridge_tower_embedding = os.getenv("BRIDGE_TOWER_EMBEDDING")
 
 
+def query_text(input) -> Optional[str]:
+    """Text of the query, `text` of an EmbedDoc or `input` of a RetrievalRequest or ChatCompletionRequest."""
+    text = input.text if isinstance(input, EmbedDoc) else getattr(input, "input", None)
+    if isinstance(text, list):
+        text = " ".join(item for item in text if isinstance(item, str))
+    return text
+
+
+def validate_request(input):
+    """Reject with a 400 the requests that cannot be searched as asked."""
+    if getattr(input, "search_type", None) == "hybrid" and not query_text(input):
+        raise HTTPException(status_code=400, detail="hybrid search needs the query text in text or input")
+    if getattr(input, "ef_runtime", None):
+        if local_store:
+            raise HTTPException(status_code=400, detail="ef_runtime is not supported by the local engine")
+        if native_engine.schema.algorithm != "HNSW":
+            raise HTTPException(
+                status_code=400,
+                detail=f"ef_runtime only applies to HNSW indexes, {INDEX_NAME} uses {native_engine.schema.algorithm}",
+            )
+    constraints = getattr(input, "constraints", None)
+    if not constraints:
+        return
+    if local_store or input.search_type in ("similarity_score_threshold", "mmr"):
+        raise HTTPException(
+            status_code=400, detail=f"constraints are not supported by {input.search_type} searches on this engine"
+        )
+    if missing_filter_fields:
+        raise HTTPException(
+            status_code=503,
+            detail=f"{INDEX_NAME} has no {missing_filter_fields} fields to filter on, rebuild it with rebuild_index.py",
+        )
+    try:
+        constraints_to_filter(native_engine.schema, constraints)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def search_documents(input: Union[EmbedDoc, EmbedMultimodalDoc, RetrievalRequest, ChatCompletionRequest]):
+    """Run the search described by `input` against the vector index."""
+    if isinstance(input, EmbedDoc) or isinstance(input, EmbedMultimodalDoc):
+        embedding_data_input = input.embedding
+    else:
+        # for RetrievalRequest, ChatCompletionRequest
+        if isinstance(input.embedding, EmbeddingResponse):
+            embeddings = input.embedding.data
+            embedding_data_input = []
+            for emb in embeddings:
+                # each emb is EmbeddingResponseData
+                embedding_data_input.append(emb.embedding)
+        else:
+            embedding_data_input = input.embedding
+
+    if local_store and input.search_type not in ("similarity", "similarity_distance_threshold"):
+        raise ValueError(f"{input.search_type} is not supported by the local engine")
+    if float16_index and input.search_type not in ("similarity", "similarity_distance_threshold", "hybrid"):
+        raise ValueError(f"{input.search_type} is not supported on a FLOAT16 index")
+
+    # constraints are pushed into the KNN query as a pre-filter, so scoped searches still return k chunks,
+    # they were checked by validate_request
+    constraints = getattr(input, "constraints", None)
+    filter_expression = constraints_to_filter(native_engine.schema, constraints) if constraints else None
+
+    # searches tuned or filtered per request need the native engine
+    ef_runtime = getattr(input, "ef_runtime", None)
+    use_native = native_engine is not None and (RETRIEVER_ENGINE == "native" or ef_runtime or filter_expression)
+
+    if input.search_type == "similarity":
+        if local_store:
+            search_res = await asyncio.get_running_loop().run_in_executor(
+                None, local_store.search, embedding_data_input, input.k
+            )
+        elif use_native:
+            search_res = await native_engine.search(
+                embedding_data_input, k=input.k, filter_expression=filter_expression, ef_runtime=ef_runtime
+            )
+        else:
+            search_res = await vector_db.asimilarity_search_by_vector(embedding=embedding_data_input, k=input.k)
+    elif input.search_type == "similarity_distance_threshold":
+        if input.distance_threshold is None:
+            raise ValueError("distance_threshold must be provided for " + "similarity_distance_threshold retriever")
+        if local_store:
+            search_res = await asyncio.get_running_loop().run_in_executor(
+                None, local_store.search, embedding_data_input, input.k, input.distance_threshold
+            )
+        elif use_native:
+            search_res = await native_engine.search(
+                embedding_data_input,
+                k=input.k,
+                filter_expression=filter_expression,
+                distance_threshold=input.distance_threshold,
+                ef_runtime=ef_runtime,
+            )
+        else:
+            search_res = await vector_db.asimilarity_search_by_vector(
+                embedding=input.embedding, k=input.k, distance_threshold=input.distance_threshold
+            )
+    elif input.search_type == "hybrid":
+        text = query_text(input)
+        if not text:
+            raise ValueError("The query text must be provided for hybrid retriever")
+        search_res = await native_engine.hybrid_search(
+            embedding_data_input,
+            text,
+            k=input.k,
+            fetch_k=input.fetch_k,
+            filter_expression=filter_expression,
+            ef_runtime=ef_runtime,
+            vector_weight=HYBRID_VECTOR_WEIGHT,
+            text_weight=HYBRID_TEXT_WEIGHT,
+            rrf_k=HYBRID_RRF_K,
+        )
+    elif input.search_type == "similarity_score_threshold":
+        docs_and_similarities = await vector_db.asimilarity_search_with_relevance_scores(
+            query=input.text, k=input.k, score_threshold=input.score_threshold
+        )
+        search_res = [doc for doc, _ in docs_and_similarities]
+    elif input.search_type == "mmr":
+        search_res = await vector_db.amax_marginal_relevance_search(
+            query=input.text, k=input.k, fetch_k=input.fetch_k, lambda_mult=input.lambda_mult
+        )
+    else:
+        raise ValueError(f"{input.search_type} not valid")
+    return search_res
+
+
+async def index_is_empty() -> bool:
+    if local_store:
+        return len(local_store) == 0
+    return await index_state.is_empty()
+
+
+async def get_metadata_list(search_res) -> List[Dict]:
+    """Metadata of the retrieved chunks, with the source of chunks ingested before provenance was stored on them."""
+    # provenance is stored on the chunk hashes, only chunks ingested before that need a lookup
+    legacy_ids = [r.metadata['id'] for r in search_res if not r.metadata.get('file_name')]
+    legacy_sources = dict(zip(legacy_ids, await get_chunk_sources(legacy_ids)))
+    metadata_list = []
+    for r in search_res:
+        metadata = dict(r.metadata)
+        if metadata['id'] in legacy_sources:
+            metadata.update(legacy_sources[metadata['id']] or {'file_name': None})
+        metadata_list.append(_cast_source_fields(metadata))
+    return metadata_list
+
+
 @register_microservice(
     name="opea_service@retriever_redis",
     service_type=ServiceType.RETRIEVER,
@@ -67,60 +297,24 @@ async def retrieve(
     if logflag:
         logger.info(input)
     start = time.time()
+    validate_request(input)
     # check if the Redis index has data
-    if vector_db.client.keys() == []:
+    if await index_is_empty():
         search_res = []
     else:
-        if isinstance(input, EmbedDoc) or isinstance(input, EmbedMultimodalDoc):
-            embedding_data_input = input.embedding
-        else:
-            # for RetrievalRequest, ChatCompletionRequest
-            if isinstance(input.embedding, EmbeddingResponse):
-                embeddings = input.embedding.data
-                embedding_data_input = []
-                for emb in embeddings:
-                    # each emb is EmbeddingResponseData
-                    embedding_data_input.append(emb.embedding)
-            else:
-                embedding_data_input = input.embedding
-
         # if the Redis index has data, perform the search
-        if input.search_type == "similarity":
-            search_res = await vector_db.asimilarity_search_by_vector(embedding=embedding_data_input, k=input.k)
-        elif input.search_type == "similarity_distance_threshold":
-            if input.distance_threshold is None:
-                raise ValueError("distance_threshold must be provided for " + "similarity_distance_threshold retriever")
-            search_res = await vector_db.asimilarity_search_by_vector(
-                embedding=input.embedding, k=input.k, distance_threshold=input.distance_threshold
-            )
-        elif input.search_type == "similarity_score_threshold":
-            docs_and_similarities = await vector_db.asimilarity_search_with_relevance_scores(
-                query=input.text, k=input.k, score_threshold=input.score_threshold
-            )
-            search_res = [doc for doc, _ in docs_and_similarities]
-        elif input.search_type == "mmr":
-            search_res = await vector_db.amax_marginal_relevance_search(
-                query=input.text, k=input.k, fetch_k=input.fetch_k, lambda_mult=input.lambda_mult
-            )
-        else:
-            raise ValueError(f"{input.search_type} not valid")
+        search_res = await search_documents(input)
 
     # return different response format
     retrieved_docs = []
+    metadata_list = await get_metadata_list(search_res)
     if isinstance(input, EmbedDoc) or isinstance(input, EmbedMultimodalDoc):
-        metadata_list = []
         for r in search_res:
-            file_name = get_file_name(r.metadata['id'])
-            metadata_list.append({**r.metadata, 'file_name': file_name})
             retrieved_docs.append(TextDoc(text=r.page_content))
         result = SearchedMultimodalDoc(retrieved_docs=retrieved_docs, initial_query=input.text, metadata=metadata_list)
     else:
-        for r in search_res:
-            file_name = get_file_name(r.metadata['id'])
-            retrieved_docs.append(RetrievalResponseData(
-                text=r.page_content,
-                metadata={**r.metadata, 'file_name': file_name}
-            ))
+        for r, metadata in zip(search_res, metadata_list):
+            retrieved_docs.append(RetrievalResponseData(text=r.page_content, metadata=metadata))
         if isinstance(input, RetrievalRequest):
             result = RetrievalResponse(retrieved_docs=retrieved_docs)
         elif isinstance(input, ChatCompletionRequest):
@@ -134,12 +328,83 @@ async def retrieve(
     return result
 
 
+@register_microservice(
+    name="opea_service@retriever_redis",
+    service_type=ServiceType.RETRIEVER,
+    endpoint="/v1/retrieval/batch",
+    host="0.0.0.0",
+    port=7000,
+)
+@register_statistics(names=["opea_service@retriever_redis_batch"])
+async def retrieve_batch(input: RetrievalBatchRequest) -> RetrievalBatchResponse:
+    """Run many retrievals in one call, at most `RETRIEVAL_BATCH_CONCURRENCY` searches at a time.
+
+    Results are returned in the order of the requests.
+    """
+    if (input.requests is None) == (input.embeddings is None):
+        raise HTTPException(status_code=400, detail="Provide either requests or embeddings.")
+    requests = input.requests
+    if requests is None:
+        requests = [
+            RetrievalRequest(
+                embedding=embedding,
+                search_type=input.search_type,
+                k=input.k,
+                distance_threshold=input.distance_threshold,
+                constraints=input.constraints,
+            )
+            for embedding in input.embeddings
+        ]
+    if len(requests) > RETRIEVAL_BATCH_MAX_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {RETRIEVAL_BATCH_MAX_SIZE} queries per batch.")
+    if logflag:
+        logger.info(f"[ retrieve batch ] {len(requests)} queries")
+    start = time.time()
+    for request in requests:
+        validate_request(request)
+
+    if await index_is_empty():
+        search_results = [[] for _ in requests]
+    else:
+        semaphore = asyncio.Semaphore(RETRIEVAL_BATCH_CONCURRENCY)
+
+        async def search(request):
+            async with semaphore:
+                return await search_documents(request)
+
+        search_results = await asyncio.gather(*(search(request) for request in requests))
+
+    # resolve the metadata of all results together, legacy sources cost one lookup for the whole batch
+    metadata_list = iter(await get_metadata_list([doc for search_res in search_results for doc in search_res]))
+    results = []
+    for search_res in search_results:
+        retrieved_docs = [RetrievalResponseData(text=r.page_content, metadata=next(metadata_list)) for r in search_res]
+        results.append(RetrievalResponse(retrieved_docs=retrieved_docs))
+    statistics_dict["opea_service@retriever_redis_batch"].append_latency(time.time() - start, None)
+    return RetrievalBatchResponse(results=results)
+
+
 if __name__ == "__main__":
+    if RETRIEVER_ENGINE not in ("langchain", "native", "local"):
+        raise ValueError(f"RETRIEVER_ENGINE should be langchain, native or local, got {RETRIEVER_ENGINE}")
+    index_state = None
+    float16_index = False
+    missing_filter_fields = []
+    native_engine = None
+    local_store = None
+    if RETRIEVER_ENGINE == "local":
+        # searches the store written by dataprep, Redis Stack is not needed
+        local_store = LocalVectorStore(
+            LOCAL_STORE_PATH, quantization=LOCAL_STORE_QUANTIZATION, rescore=LOCAL_STORE_RESCORE
+        )
     # Create vectorstore
-    if tei_embedding_endpoint:
+    elif tei_embedding_endpoint:
         # create embeddings using TEI endpoint service
         embeddings = HuggingFaceEndpointEmbeddings(model=tei_embedding_endpoint)
-        vector_db = Redis(embedding=embeddings, index_name=INDEX_NAME, redis_url=REDIS_URL)
+        # EMBED_MODEL does not name the model a TEI endpoint serves
+        model = tei_model_key(tei_embedding_endpoint)
+        embeddings = cached_embeddings(embeddings, model, EMBED_CACHE_PATH, EMBED_CACHE_MAX_ENTRIES)
+        vector_db = Redis(embedding=embeddings, index_name=INDEX_NAME, index_schema=INDEX_SCHEMA, redis_url=REDIS_URL)
     # TODO: Add more support
     # elif bridge_tower_embedding:
     #     # create embeddings using BridgeTower service
@@ -148,6 +413,28 @@ if __name__ == "__main__":
     else:
         # create embeddings using local embedding model
         embeddings = HuggingFaceEmbeddings(model_name=EMBED_MODEL)
-        vector_db = Redis(embedding=embeddings, index_name=INDEX_NAME, redis_url=REDIS_URL)
+        embeddings = cached_embeddings(embeddings, EMBED_MODEL, EMBED_CACHE_PATH, EMBED_CACHE_MAX_ENTRIES)
+        vector_db = Redis(embedding=embeddings, index_name=INDEX_NAME, index_schema=INDEX_SCHEMA, redis_url=REDIS_URL)
 
-    opea_microservices["opea_service@retriever_redis"].start()
\ No newline at end of file
+    if not local_store:
+        index_state = IndexStateTracker(get_async_client(), INDEX_NAME)
+        # also serves the searches passing ef_runtime when the langchain engine is selected
+        index_schema = IndexSchema.from_yaml(INDEX_SCHEMA, VECTOR_INDEX_OVERRIDES)
+        native_engine = NativeSearchEngine(get_async_client(), index_schema, INDEX_NAME)
+        # langchain only encodes FLOAT32 and FLOAT64 vectors
+        float16_index = index_schema.vector["datatype"] == "FLOAT16"
+        if float16_index and RETRIEVER_ENGINE != "native":
+            raise ValueError("A FLOAT16 index is only searched by the native engine, set RETRIEVER_ENGINE=native")
+        # an index created before the tag and numeric fields were added to the schema cannot be filtered
+        attributes = index_attributes(redis.Redis.from_url(REDIS_URL), INDEX_NAME)
+        if attributes:
+            expected = {key: "TAG" for key in index_schema.tag_keys}
+            expected.update({key: "NUMERIC" for key in index_schema.numeric_keys})
+            missing_filter_fields = [key for key, kind in expected.items() if attributes.get(key) != kind]
+        if missing_filter_fields:
+            logger.warning(
+                f"[ retriever ] {INDEX_NAME} has no {missing_filter_fields} filter fields, searches with constraints "
+                "are refused until the index is re-created with rebuild_index.py"
+            )
+    logger.info(f"[ retriever ] similarity searches run on the {RETRIEVER_ENGINE} engine")
+    opea_microservices["opea_service@retriever_redis"].start()
@@ -6,6 +6,8 @@ NO HEAVY DOWNLOADS - reuses existing dataprep container
 import os
 import redis
 import json
+import threading
+import time
 from typing import List, Dict, Any
 import numpy as np
 from fastapi import FastAPI, HTTPException
@@ -19,6 +21,12 @@ app = FastAPI()
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
 INDEX_NAME = os.getenv("INDEX_NAME", "rag-redis")
 DATAPREP_URL = os.getenv("DATAPREP_URL", "http://localhost:5006")
+# Seconds between two checks for chunks added or deleted since the last refresh
+REFRESH_INTERVAL = float(os.getenv("REFRESH_INTERVAL", 30))
+# Counter dataprep increments on every ingest and delete, the chunk keys are only scanned when it changed
+CORPUS_VERSION_KEY = os.getenv("CORPUS_VERSION_KEY", "corpus:version")
+# Encoding of the stored vectors, FLOAT32 or FLOAT16 (same as the dataprep INDEX_DATATYPE)
+VECTOR_DTYPE = np.float16 if os.getenv("INDEX_DATATYPE", "FLOAT32").upper() == "FLOAT16" else np.float32
 
 redis_client = redis.from_url(REDIS_URL)
 
@@ -46,8 +54,114 @@ def get_embedding_from_dataprep(text: str):
         print(f"Error getting embedding from dataprep: {e}")
         return None
 
-def cosine_similarity(a, b):
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+class VectorMatrix:
+    """All chunk vectors of the index kept in memory as one normalized float32 matrix.
+
+    Loaded once with pipelined HGETs and refreshed incrementally by a
+    background thread: every REFRESH_INTERVAL seconds the corpus version
+    written by dataprep is read, and only when it changed are the chunk keys
+    listed with SCAN and the vectors of new chunks fetched. The refreshed keys
+    and matrix are swapped in at once, so searches never wait for a refresh.
+    A query is scored with a single matrix-vector product and the top k found
+    with argpartition.
+    """
+
+    def __init__(self, client, prefix: str, batch_size: int = 1000):
+        self.client = client
+        self.prefix = prefix
+        self.batch_size = batch_size
+        # (keys, matrix), replaced as a whole by refresh()
+        self.state = ([], None)
+        self.version = None
+        self.refreshed_at = 0.0
+        self.lock = threading.Lock()
+
+    def _fetch_vectors(self, keys):
+        vectors = []
+        for i in range(0, len(keys), self.batch_size):
+            pipe = self.client.pipeline(transaction=False)
+            for key in keys[i : i + self.batch_size]:
+                pipe.hget(key, "content_vector")
+            vectors.extend(pipe.execute())
+        return vectors
+
+    def refresh(self):
+        with self.lock:
+            # read before scanning, changes made during the scan are picked up by the next refresh
+            version = self.client.get(CORPUS_VERSION_KEY)
+            self.refreshed_at = time.time()
+            if version is not None and version == self.version:
+                return
+            keys, matrix = self.state
+            current = set(self.client.scan_iter(match=f"{self.prefix}*", count=self.batch_size))
+            known = set(keys)
+            removed = known - current
+            added = list(current - known)
+
+            if removed:
+                keep = [i for i, key in enumerate(keys) if key not in removed]
+                keys = [keys[i] for i in keep]
+                matrix = matrix[keep]
+
+            if added:
+                rows, new_keys = [], []
+                dims = matrix.shape[1] if matrix is not None and len(matrix) else None
+                for key, vector_bytes in zip(added, self._fetch_vectors(added)):
+                    if not vector_bytes:
+                        continue
+                    vector = np.frombuffer(vector_bytes, dtype=VECTOR_DTYPE).astype(np.float32)
+                    dims = dims or len(vector)
+                    # Skip if dimensions don't match
+                    if len(vector) != dims:
+                        print(f"Dimension mismatch: stored={len(vector)}, expected={dims}")
+                        continue
+                    rows.append(vector)
+                    new_keys.append(key)
+                if rows:
+                    block = np.vstack(rows)
+                    norms = np.linalg.norm(block, axis=1, keepdims=True)
+                    block /= np.where(norms == 0, 1, norms)
+                    matrix = block if matrix is None or not len(matrix) else np.vstack([matrix, block])
+                    keys = keys + new_keys
+
+            self.state = (keys, matrix)
+            self.version = version
+            if added or removed:
+                print(f"Vector matrix refreshed: {len(keys)} chunks (+{len(added)}, -{len(removed)})")
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(REFRESH_INTERVAL)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error refreshing vector matrix: {e}")
+
+    def start(self):
+        """Refresh the matrix every REFRESH_INTERVAL seconds in a background thread."""
+        threading.Thread(target=self._refresh_loop, name="vector-matrix-refresh", daemon=True).start()
+
+    def search(self, query_embedding, k: int):
+        """Return the `(key, similarity)` of the k chunks closest to the query, best first."""
+        keys, matrix = self.state
+        if matrix is None or not len(keys):
+            return []
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        if len(query) != matrix.shape[1]:
+            raise HTTPException(
+                status_code=400, detail=f"Query dimension {len(query)} does not match stored {matrix.shape[1]}"
+            )
+        scores = matrix @ (query / (np.linalg.norm(query) or 1))
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(keys[i], float(scores[i])) for i in top]
+
+
+vector_matrix = VectorMatrix(redis_client, f"doc:{INDEX_NAME}:")
+
 
 @app.post("/v1/retrieval", response_model=RetrievalResponse)
 async def retrieve(request: RetrievalRequest):
@@ -58,61 +172,29 @@ async def retrieve(request: RetrievalRequest):
         if query_embedding is None:
             raise HTTPException(status_code=500, detail="Failed to get embedding from dataprep")
         
-        print(f"Query embedding dimension: {len(query_embedding)}")
-        
-        # Get all document keys
-        keys = redis_client.keys(f"doc:{INDEX_NAME}:*")
-        print(f"Found {len(keys)} documents in Redis")
-        
-        results = []
-        query_vector = np.array(query_embedding)
-        
-        for key in keys:
-            doc_data = redis_client.hgetall(key)
-            if not doc_data:
-                continue
-                
-            # Get the stored vector
-            vector_bytes = doc_data.get(b'content_vector')
-            if not vector_bytes:
-                continue
-                
-            # Convert bytes to numpy array
-            stored_vector = np.frombuffer(vector_bytes, dtype=np.float32)
-            
-            # Skip if dimensions don't match
-            if len(stored_vector) != len(query_vector):
-                print(f"Dimension mismatch: stored={len(stored_vector)}, query={len(query_vector)}")
-                continue
-            
-            # Calculate similarity
-            similarity = cosine_similarity(query_vector, stored_vector)
-            
-            # Get text content
-            content = doc_data.get(b'content', b'').decode('utf-8')
-            
-            results.append({
-                'text': content,
-                'similarity': float(similarity),
-                'metadata': {
-                    'id': key.decode('utf-8'),
-                    'source': doc_data.get(b'source', b'').decode('utf-8')
-                }
-            })
-        
-        # Sort by similarity and return top k
-        results.sort(key=lambda x: x['similarity'], reverse=True)
+        top = vector_matrix.search(query_embedding, request.k)
+
+        # Fetch the text and source of the top k chunks only
+        pipe = redis_client.pipeline(transaction=False)
+        for key, _ in top:
+            pipe.hmget(key, "content", "source", "file_name")
         
         # Format results
         retrieved_docs = []
-        for result in results[:request.k]:
+        for (key, similarity), (content, source, file_name) in zip(top, pipe.execute()):
             retrieved_docs.append({
-                'text': result['text'],
-                'metadata': result['metadata']
+                'text': (content or b'').decode('utf-8'),
+                'metadata': {
+                    'id': key.decode('utf-8'),
+                    'source': (source or b'').decode('utf-8'),
+                    'file_name': (file_name or b'').decode('utf-8'),
+                }
             })
         
         return RetrievalResponse(retrieved_docs=retrieved_docs)
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in retrieval: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -122,4 +204,6 @@ async def health():
     return {"status": "healthy", "uses_dataprep_embedding": True}
 
 if __name__ == "__main__":
+    vector_matrix.refresh()
+    vector_matrix.start()
     uvicorn.run(app, host="0.0.0.0", port=7000)
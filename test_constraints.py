@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Test the translation of retrieval constraints into RediSearch filters
+"""
+import os
+import urllib.parse
+
+from comps.core.redis_schema import IndexSchema
+from comps.retriever.native_search import constraints_to_filter
+
+SCHEMA = IndexSchema.from_yaml(os.path.join(os.path.dirname(__file__), "comps", "retriever", "redis_schema_multi.yml"))
+
+
+def test_file_name_with_space():
+    # dataprep stores the percent-encoded name on the chunks, users see the decoded one
+    expression = constraints_to_filter(SCHEMA, {"file_name": "my paper.pdf"})
+    assert expression == r"@file_name:{my\%20paper\.pdf | my\ paper\.pdf}", expression
+
+
+def test_file_name_non_ascii():
+    name = "résumé 2.0.pdf"
+    expression = constraints_to_filter(SCHEMA, {"file_name": [name]})
+    encoded = urllib.parse.quote(name, safe="")
+    assert encoded.replace("%", "\\%").replace(".", "\\.") in expression, expression
+
+
+def test_encoded_file_name_matches_as_given():
+    expression = constraints_to_filter(SCHEMA, {"file_name": "my%20paper.pdf"})
+    assert r"my\%20paper\.pdf" in expression, expression
+
+
+def test_malformed_range_names_the_field():
+    try:
+        constraints_to_filter(SCHEMA, {"page": {"gte": "first"}})
+    except ValueError as e:
+        assert "page" in str(e)
+    else:
+        raise AssertionError("a non-numeric range was accepted")
+
+
+if __name__ == "__main__":
+    for test in (
+        test_file_name_with_space,
+        test_file_name_non_ascii,
+        test_encoded_file_name_matches_as_given,
+        test_malformed_range_names_the_field,
+    ):
+        test()
+        print(f"✅ {test.__name__}")